@@ -0,0 +1,46 @@
+'''
+Subpackages and the public names below are imported on first use, so importing the package, or
+only its file handling and metrics functions, does not load matplotlib, seaborn or sklearn.
+'''
+
+import importlib
+
+#Submodules, and public names with the submodule defining each, imported on first use (PEP 562)
+_SUBMODULES = ['benchmarks', 'clustering', 'data_structuring', 'file_handling', 'plotting', 'test_metrics']
+_PUBLIC = {
+    'get_cluster_within_groups_order': 'clustering',
+    'LinkageCache': 'clustering',
+    'get_group_members': 'data_structuring.dataframe_ops',
+    'GroupIndex': 'data_structuring.dataframe_ops',
+    'produce_variant_file': 'file_handling.reformat_maf',
+    'produce_merged_variant_file': 'file_handling.reformat_maf',
+    'produce_copy_number_file': 'file_handling.reformat_maf',
+    'read_variant_matrix': 'file_handling.reformat_maf',
+    'BitMatrix': 'file_handling.bit_matrix',
+    'GeneSets': 'file_handling.gmt',
+    'enrichment': 'file_handling.gmt',
+    'make_color_annotations': 'plotting.colorscales',
+    'stacked_bar': 'plotting.stacked_bar',
+    'plot_silhouettes': 'plotting.silhouette',
+    'calculate': 'test_metrics.test_metrics',
+    'confusion_counts': 'test_metrics.test_metrics',
+    'threshold_sweep': 'test_metrics.test_metrics',
+    'MetricsAccumulator': 'test_metrics.test_metrics',
+    'bootstrap_metrics': 'test_metrics.test_metrics',
+    'permutation_metrics': 'test_metrics.test_metrics',
+    }
+__all__ = sorted(set(_SUBMODULES) | set(_PUBLIC))
+
+def __getattr__(name):
+    if name in _PUBLIC:
+        value = getattr(importlib.import_module(__name__+'.'+_PUBLIC[name]), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module(__name__+'.'+name)
+    else:
+        raise AttributeError("module "+repr(__name__)+" has no attribute "+repr(name))
+    #Later accesses find the name without calling __getattr__
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return __all__
@@ -0,0 +1,190 @@
+'''
+Times importing each entry point of the package in a fresh interpreter and checks that the file
+handling, data structuring and metrics paths never load the plotting libraries, so short batch
+jobs keep a fast startup. Results are kept as JSON so runs on different commits can be compared.
+
+Run from the directory containing the package, ex.
+    python -m Utilities.benchmarks.import_time --output imports.json
+    python -m Utilities.benchmarks.import_time --baseline imports.json
+    python -m Utilities.benchmarks.import_time --profile reformat_maf
+
+Exits with 1 if an entry point loads a module it must not, or is slower than the baseline.
+
+Author: Stephanie Ting
+Stephanie.Ting.3@gmail.com
+
+Last edited:
+10/17/2026
+'''
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from .reformat_maf_benchmark import save_results, load_results, _environment
+
+PACKAGE=__package__.split('.')[0]
+
+#Statement run for each entry point, with the package name filled in
+ENTRY_POINTS={
+    'package': "import {package}",
+    'reformat_maf': "from {package}.file_handling import reformat_maf",
+    'bit_matrix': "from {package}.file_handling import BitMatrix",
+    'gmt': "from {package}.file_handling import GeneSets",
+    'data_structuring': "from {package}.data_structuring import GroupIndex, intersect_arrays",
+    'test_metrics': "from {package}.test_metrics import calculate, MetricsAccumulator",
+    'clustering': "from {package} import get_cluster_within_groups_order",
+    'plotting': "from {package}.plotting import make_color_annotations",
+    }
+
+#Modules each entry point must not load
+HEAVY_MODULES=['matplotlib', 'seaborn', 'sklearn']
+FORBIDDEN={
+    'package': HEAVY_MODULES+['pandas', 'scipy'],
+    'reformat_maf': HEAVY_MODULES,
+    'bit_matrix': HEAVY_MODULES,
+    'gmt': HEAVY_MODULES,
+    'data_structuring': HEAVY_MODULES+['scipy'],
+    'test_metrics': HEAVY_MODULES+['pandas', 'scipy'],
+    'clustering': HEAVY_MODULES+['scipy.cluster'],
+    'plotting': ['sklearn'],
+    }
+
+#Run in the child interpreter: times the statement and lists the top level modules loaded
+_CHILD="""
+import sys, time, json
+start=time.perf_counter()
+exec({statement!r})
+seconds=time.perf_counter()-start
+print(json.dumps({{'seconds': seconds, 'modules': sorted(sys.modules)}}))
+"""
+
+def time_import(statement, repeats=5, python=sys.executable):
+    '''
+    Times a statement in fresh interpreters
+
+    statement - string - Python statement, ex. "import Utilities"
+    repeats - int - number of interpreters, the median time is kept
+    python - string - path of the Python interpreter
+
+    Returns dict with the median 'seconds' and the sorted 'modules' loaded by the statement
+    '''
+    baseline=_run_child("pass", python)
+    times=[]
+    for i in range(repeats):
+        result=_run_child(statement, python)
+        times.append(result['seconds'])
+    times.sort()
+    return {'seconds': times[len(times)//2],
+            'modules': sorted(set(result['modules'])-set(baseline['modules']))}
+
+def run_benchmarks(entry_points=None, repeats=5, python=sys.executable):
+    '''
+    Times every entry point and checks the modules it loads
+
+    entry_points - list of names of ENTRY_POINTS, defaults to all
+
+    Returns dict with 'meta' (commit and library versions) and 'entry_points', a dict of entry point
+    name to its 'seconds', 'statement' and the 'forbidden' modules it loaded
+    '''
+    results={'meta': _environment(), 'entry_points': {}}
+    for name in entry_points or list(ENTRY_POINTS):
+        statement=ENTRY_POINTS[name].format(package=PACKAGE)
+        result=time_import(statement, repeats, python)
+        forbidden=[i for i in FORBIDDEN.get(name, []) if _loaded(i, result['modules'])]
+        results['entry_points'][name]={'statement': statement, 'seconds': result['seconds'], 'forbidden': forbidden}
+        print(name.ljust(18)+("%.3f" % result['seconds']).rjust(8)+" s"
+              +("  LOADS "+", ".join(forbidden) if forbidden else ""))
+    return results
+
+def compare_results(old_results, new_results, tolerance=0.25, min_seconds=0.05):
+    '''
+    Compares the import times of two results
+
+    old_results, new_results - dicts returned by run_benchmarks or paths to their JSON files
+    tolerance - float - relative slowdown reported as a regression
+    min_seconds - float - slowdowns smaller than this many seconds are not regressions, to ignore
+                  the noise of very fast imports
+
+    Returns list of (entry point, old seconds, new seconds) tuples of the regressions
+    '''
+    if isinstance(old_results, str):
+        old_results=load_results(old_results)
+    if isinstance(new_results, str):
+        new_results=load_results(new_results)
+
+    print(old_results['meta']['commit']+" -> "+new_results['meta']['commit'])
+    regressions=[]
+    for name, result in new_results['entry_points'].items():
+        old=old_results['entry_points'].get(name)
+        if old is None or old['seconds']==0:
+            continue
+        ratio=result['seconds']/old['seconds']
+        flag=''
+        if ratio>1+tolerance and result['seconds']-old['seconds']>min_seconds:
+            flag='  REGRESSION'
+            regressions.append((name, old['seconds'], result['seconds']))
+        print("    "+name.ljust(18)+("%.2fx" % ratio).rjust(8)+flag)
+    return regressions
+
+def profile_import(statement, n=20, python=sys.executable):
+    '''
+    Returns list of (cumulative microseconds, module) of the n slowest imports of a statement,
+    from python -X importtime
+    '''
+    process=subprocess.run([python, '-X', 'importtime', '-c', statement], capture_output=True, text=True,
+                           env=_child_env(), check=True)
+    imports=[]
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and not 'cumulative' in line:
+            self_time, cumulative, module=line[len('import time:'):].split('|')
+            imports.append((int(cumulative), module.strip()))
+    return sorted(imports, reverse=True)[:n]
+
+def _run_child(statement, python):
+    process=subprocess.run([python, '-c', _CHILD.format(statement=statement)], capture_output=True,
+                           text=True, env=_child_env(), check=True)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+def _child_env():
+    '''
+    Internal function returning the environment of child interpreters, with the directory
+    containing the package on the path
+    '''
+    root=os.path.dirname(os.path.abspath(sys.modules[PACKAGE].__path__[0]))
+    env=dict(os.environ)
+    env['PYTHONPATH']=root+(os.pathsep+env['PYTHONPATH'] if env.get('PYTHONPATH') else '')
+    return env
+
+def _loaded(module, modules):
+    return any(i==module or i.startswith(module+'.') for i in modules)
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Time importing the entry points of the package")
+    parser.add_argument('--entry-points', nargs='+', choices=list(ENTRY_POINTS), default=None)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    parser.add_argument('--baseline', default=None, help="JSON results to compare the run to")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--profile', choices=list(ENTRY_POINTS), default=None,
+                        help="list the slowest imports of one entry point instead of running")
+    args=parser.parse_args(argv)
+
+    if args.profile:
+        for cumulative, module in profile_import(ENTRY_POINTS[args.profile].format(package=PACKAGE)):
+            print(("%.3f" % (cumulative/1e6)).rjust(8)+" s  "+module)
+        return 0
+
+    results=run_benchmarks(args.entry_points, args.repeats)
+    if args.output is not None:
+        save_results(results, args.output)
+        print("Results written to "+args.output)
+
+    failed=any(result['forbidden'] for result in results['entry_points'].values())
+    if args.baseline is not None:
+        failed=bool(compare_results(args.baseline, results, args.tolerance)) or failed
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
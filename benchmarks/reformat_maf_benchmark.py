@@ -0,0 +1,292 @@
+'''
+Times and memory-profiles each stage of produce_variant_file on synthetic maf files and keeps
+the results as JSON, so runs on different commits can be compared.
+
+Run from the directory containing the package, ex.
+    python -m Utilities.benchmarks.reformat_maf_benchmark --rows 10000 1000000 --output bench.json
+    python -m Utilities.benchmarks.reformat_maf_benchmark --compare old.json new.json
+
+Author: Stephanie Ting
+Stephanie.Ting.3@gmail.com
+
+Last edited:
+10/17/2026
+'''
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+import pandas as pd
+from ..file_handling import reformat_maf
+from .synthetic_maf import write_synthetic_maf
+
+def benchmark_stages(
+    maf_input_file,
+    output_file,
+    key_file=None,
+    gene_identifier_format=None,
+    variant_thres=80,
+    change_thres=80,
+    skiprows=1,
+    output_format='npz',
+    chunksize=None,
+    cache_dir=None,
+    trace_memory=True,
+    **kwargs):
+
+    """
+    Runs produce_variant_file on one file and records the 'end' event of each stage it reports,
+    so the timings follow the real code paths. With chunksize the 'read' stage only opens the
+    file, the chunks are read in the 'counting' and 'matrix build' stages
+
+    Parameters:
+
+        maf_input_file - string - file path to the maf file
+
+        output_file - string - file path to write the output to
+
+        trace_memory - boolean - if true also records the peak memory allocated in each stage with
+            tracemalloc, which slows down every stage
+
+        kwargs and all other parameters are passed to reformat_maf.produce_variant_file.
+
+    Returns:
+        dict with the stages as keys, in the order they first started, and dicts of 'seconds',
+        'peak_bytes' (None without trace_memory), 'peak_rss' (peak resident memory of the process
+        when the stage ended) and the stage's own fields (ex. 'rows') as values. Stages reported
+        more than once have their seconds summed and the largest peaks kept
+    """
+
+    results={}
+    #Peak traced memory of each open stage so far, stages can be nested
+    open_peaks={}
+
+    def fold_peak():
+        peak=tracemalloc.get_traced_memory()[1]
+        for name in open_peaks:
+            open_peaks[name]=max(open_peaks[name], peak)
+        tracemalloc.reset_peak()
+
+    def record(event):
+        name=event['stage']
+        if event['event']=='start':
+            if trace_memory:
+                fold_peak()
+                open_peaks[name]=0
+        elif event['event']=='end':
+            peak_bytes=None
+            if trace_memory:
+                fold_peak()
+                peak_bytes=open_peaks.pop(name, None)
+            fields={i: event[i] for i in event if not i in ['event', 'stage', 'seconds', 'peak_rss', 'function', 'input_file']}
+            if name in results:
+                result=results[name]
+                result['seconds']+=event['seconds']
+                result['peak_bytes']=_max_or_none(result['peak_bytes'], peak_bytes)
+                result['peak_rss']=_max_or_none(result['peak_rss'], event['peak_rss'])
+                result.update(fields)
+            else:
+                results[name]=dict(fields, seconds=event['seconds'], peak_bytes=peak_bytes, peak_rss=event['peak_rss'])
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        reformat_maf.produce_variant_file(maf_input_file, output_file, key_file=key_file,
+                                          gene_identifier_format=gene_identifier_format, variant_thres=variant_thres,
+                                          change_thres=change_thres, skiprows=skiprows, output_format=output_format,
+                                          chunksize=chunksize, cache_dir=cache_dir, progress=record, **kwargs)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return results
+
+def _max_or_none(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+def run_benchmarks(
+    row_counts=[10000, 1000000, 10000000],
+    n_samples=1000,
+    n_genes=20000,
+    protein_changes_per_gene=200,
+    seed=0,
+    use_key_file=True,
+    output_format='npz',
+    chunksize=None,
+    cache_dir=None,
+    trace_memory=True,
+    work_dir=None):
+
+    """
+    Writes a synthetic maf file for each number of rows and benchmarks its stages
+
+    Parameters:
+
+        row_counts - list of ints - number of rows of each synthetic maf file
+
+        use_key_file - boolean - if true the maf files use gene identifiers mapped with a key file
+
+        work_dir - string - directory for the synthetic files, defaults to a temporary directory
+            removed afterwards
+
+        Other parameters are described in write_synthetic_maf and benchmark_stages.
+
+    Returns:
+        dict with the run settings and environment under 'meta' and a list of results per
+        file under 'runs'
+    """
+
+    results={'meta': _environment(), 'runs': []}
+    results['meta'].update({
+        'n_samples': n_samples,
+        'n_genes': n_genes,
+        'protein_changes_per_gene': protein_changes_per_gene,
+        'seed': seed,
+        'use_key_file': use_key_file,
+        'output_format': output_format,
+        'chunksize': chunksize,
+        'cache_dir': cache_dir,
+        'trace_memory': trace_memory})
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as directory:
+        for n_rows in row_counts:
+            maf_file=os.path.join(directory, 'synthetic_'+str(n_rows)+'.maf')
+            key_file=os.path.join(directory, 'key.tsv') if use_key_file else None
+            write_synthetic_maf(maf_file, n_rows, n_samples=n_samples, n_genes=n_genes,
+                                protein_changes_per_gene=protein_changes_per_gene, seed=seed,
+                                key_output_file=key_file)
+
+            print("Benchmarking "+str(n_rows)+" rows...")
+            stages=benchmark_stages(maf_file, os.path.join(directory, 'output.'+output_format), key_file=key_file,
+                                    gene_identifier_format='Gene stable ID' if use_key_file else None,
+                                    output_format=output_format, chunksize=chunksize, cache_dir=cache_dir,
+                                    trace_memory=trace_memory)
+            results['runs'].append({'rows': n_rows, 'file_bytes': os.path.getsize(maf_file), 'stages': stages})
+            print(format_run(results['runs'][-1]))
+            os.remove(maf_file)
+
+    return results
+
+def format_run(run):
+    '''
+    Returns string table of the seconds and peak memory of each stage of one run
+    '''
+    lines=[str(run['rows'])+" rows"]
+    for stage, result in run['stages'].items():
+        line="    "+stage.ljust(14)+("%.3f" % result['seconds']).rjust(10)+" s"
+        if result['peak_bytes'] is not None:
+            line+=("%.1f" % (result['peak_bytes']/2**20)).rjust(12)+" MiB"
+        lines.append(line)
+    return "\n".join(lines)
+
+def compare_results(old_results, new_results, tolerance=0.1):
+    '''
+    Compares the stages of two results with the same numbers of rows
+
+    old_results, new_results - dicts returned by run_benchmarks or paths to their JSON files
+    tolerance - float - relative change in seconds or peak memory reported as a regression
+
+    Returns list of (rows, stage, measure, old value, new value) tuples of the regressions
+    '''
+    if isinstance(old_results, str):
+        old_results=load_results(old_results)
+    if isinstance(new_results, str):
+        new_results=load_results(new_results)
+
+    old_runs={run['rows']: run['stages'] for run in old_results['runs']}
+    regressions=[]
+    for run in new_results['runs']:
+        if not run['rows'] in old_runs:
+            continue
+        print(str(run['rows'])+" rows, "+old_results['meta']['commit']+" -> "+new_results['meta']['commit'])
+        for stage, result in run['stages'].items():
+            old=old_runs[run['rows']].get(stage)
+            if old is None:
+                continue
+            for measure in ['seconds', 'peak_bytes']:
+                if old[measure] is None or result[measure] is None or old[measure]==0:
+                    continue
+                ratio=result[measure]/old[measure]
+                flag=''
+                if ratio>1+tolerance:
+                    flag='  REGRESSION'
+                    regressions.append((run['rows'], stage, measure, old[measure], result[measure]))
+                print("    "+stage.ljust(14)+measure.ljust(12)+("%.2fx" % ratio).rjust(8)+flag)
+    return regressions
+
+def save_results(results, path):
+    '''
+    Writes results to a JSON file
+    '''
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+def load_results(path):
+    '''
+    Reads results written by save_results
+    '''
+    with open(path) as f:
+        return json.load(f)
+
+def _environment():
+    '''
+    Internal function that records the commit and library versions a benchmark ran with
+    '''
+    try:
+        commit=subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit=''
+    return {
+        'commit': commit or 'unknown',
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count()}
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description="Benchmark the stages of produce_variant_file on synthetic maf files")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 1000000, 10000000])
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--genes', type=int, default=20000)
+    parser.add_argument('--protein-changes', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-key-file', action='store_true')
+    parser.add_argument('--output-format', default='npz')
+    parser.add_argument('--chunksize', type=int, default=None, help="rows read at a time, defaults to the whole file")
+    parser.add_argument('--cache-dir', default=None, help="directory of produce_variant_file's count cache")
+    parser.add_argument('--no-memory', action='store_true', help="skip tracemalloc, for faster and more accurate timings")
+    parser.add_argument('--work-dir', default=None)
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two JSON results instead of running")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args=parser.parse_args(argv)
+
+    if args.compare:
+        regressions=compare_results(args.compare[0], args.compare[1], args.tolerance)
+        return 1 if regressions else 0
+
+    results=run_benchmarks(args.rows, n_samples=args.samples, n_genes=args.genes,
+                           protein_changes_per_gene=args.protein_changes, seed=args.seed,
+                           use_key_file=not args.no_key_file, output_format=args.output_format,
+                           chunksize=args.chunksize, cache_dir=args.cache_dir, trace_memory=not args.no_memory, work_dir=args.work_dir)
+    if args.output is not None:
+        save_results(results, args.output)
+        print("Results written to "+args.output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
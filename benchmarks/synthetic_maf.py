@@ -0,0 +1,136 @@
+'''
+Seeded generator of synthetic maf files for benchmarking file_handling.reformat_maf
+
+Author: Stephanie Ting
+Stephanie.Ting.3@gmail.com
+
+Last edited:
+10/17/2026
+'''
+
+import numpy as np
+import pandas as pd
+
+#Rough shares of variant classifications in a TCGA mutation maf
+CLASS_WEIGHTS={
+    'Missense_Mutation': 0.55,
+    'Silent': 0.22,
+    'Nonsense_Mutation': 0.05,
+    'Frame_Shift_Del': 0.04,
+    'Frame_Shift_Ins': 0.02,
+    'Splice_Site': 0.03,
+    "3'UTR": 0.04,
+    "5'UTR": 0.02,
+    'In_Frame_Del': 0.01,
+    'RNA': 0.02}
+
+#Share of all rows that fall in each hotspot gene, and share of its rows on its hotspot protein change.
+#TTN is long and mutated everywhere, TP53 is mutated in many samples at a few positions
+HOTSPOTS={
+    'TTN': (0.03, 0.0),
+    'TP53': (0.02, 0.3),
+    'MUC16': (0.01, 0.0),
+    'PIK3CA': (0.005, 0.5),
+    'KRAS': (0.005, 0.8)}
+
+def write_synthetic_maf(
+    maf_output_file,
+    n_rows,
+    n_samples=1000,
+    n_genes=20000,
+    class_weights=CLASS_WEIGHTS,
+    protein_changes_per_gene=200,
+    hotspots=HOTSPOTS,
+    gene_skew=1.1,
+    seed=0,
+    key_output_file=None,
+    chunksize=1000000):
+
+    """
+    Writes a maf file with the columns read by produce_variant_file and a '#version' line, so it
+    is read with the default skiprows=1.
+
+    Parameters:
+
+        maf_output_file - string - file path to write the maf file to
+
+        n_rows - int - number of variants
+
+        n_samples - int - number of samples. Samples are named like TCGA barcodes
+
+        n_genes - int - number of genes, including the hotspot genes
+
+        class_weights - dict - variant classifications as keys and their relative frequencies as values
+
+        protein_changes_per_gene - int - number of distinct protein changes each gene draws from
+
+        hotspots - dict - gene names as keys, tuples of the share of rows in the gene and the share
+            of the gene's rows on a single protein change as values
+
+        gene_skew - float - exponent of the Zipf-like distribution of rows over the other genes
+
+        seed - int - seed of the random generator. The same arguments always write the same file
+
+        key_output_file - string - if given also writes a key file in Ensembl format and uses its
+            'Gene stable ID' as Hugo_Symbol, for benchmarking key_file mapping. Every 100th
+            identifier is left out of the key file
+
+        chunksize - int - number of rows generated and written at a time
+
+    Returns:
+        pandas Series of gene names indexed by gene identifiers
+    """
+
+    if n_genes < len(hotspots):
+        raise AssertionError(
+                "n_genes must be at least the number of hotspot genes"
+                )
+
+    rng=np.random.default_rng(seed)
+
+    names=np.array(list(hotspots)+['GENE'+str(i) for i in range(n_genes-len(hotspots))], dtype=object)
+    if key_output_file is None:
+        genes=names
+    else:
+        genes=np.array(['ENSG'+str(i).zfill(11) for i in range(n_genes)], dtype=object)
+        key_df=pd.DataFrame({'Gene stable ID': genes, 'Gene name': names})
+        key_df.loc[np.arange(n_genes)%100!=99].to_csv(key_output_file, sep='\t', index=False)
+
+    #Hotspot genes take a fixed share of rows, the rest follow a Zipf-like distribution
+    hotspot_shares=np.array([i[0] for i in hotspots.values()], dtype=float)
+    gene_p=np.arange(1, n_genes-len(hotspots)+1, dtype=float)**-gene_skew
+    gene_p=np.concatenate([hotspot_shares, gene_p/gene_p.sum()*(1-hotspot_shares.sum())])
+    hotspot_protein=np.zeros(n_genes)
+    hotspot_protein[:len(hotspots)]=[i[1] for i in hotspots.values()]
+
+    classes=np.array(list(class_weights), dtype=object)
+    class_p=np.array(list(class_weights.values()), dtype=float)
+    class_p=class_p/class_p.sum()
+
+    samples=np.array(['TCGA-'+str(i%100).zfill(2)+'-'+str(i).zfill(4)+'-01A-11D-A00'+str(i%10)+'-08'
+                      for i in range(n_samples)], dtype=object)
+    positions=rng.integers(1, 2000, size=(n_genes, protein_changes_per_gene))
+
+    print("Writing "+str(n_rows)+" rows to "+maf_output_file)
+    with open(maf_output_file, 'w') as f:
+        f.write('#version 2.4\n')
+        header=True
+        for start in range(0, n_rows, chunksize):
+            size=min(chunksize, n_rows-start)
+            gene_codes=rng.choice(n_genes, size=size, p=gene_p)
+            class_codes=rng.choice(len(classes), size=size, p=class_p)
+
+            protein_codes=rng.integers(0, protein_changes_per_gene, size=size)
+            protein_codes[rng.random(size)<hotspot_protein[gene_codes]]=0
+            protein_change=pd.Series(positions[gene_codes, protein_codes].astype(str)).radd('p.R').add('H')
+            #Non coding classifications have no protein change
+            protein_change[np.isin(classes[class_codes], ["3'UTR", "5'UTR", 'RNA'])]=''
+
+            pd.DataFrame({
+                'Hugo_Symbol': genes[gene_codes],
+                'Tumor_Sample_Barcode': samples[rng.integers(0, n_samples, size=size)],
+                'Variant_Classification': classes[class_codes],
+                'Protein_Change': protein_change.to_numpy()}).to_csv(f, sep='\t', index=False, header=header)
+            header=False
+
+    return pd.Series(names, index=genes, name='Gene name')
@@ -1,30 +1,323 @@
 '''
 Written by: Stephanie Ting
 Created: 9/12/2024
-Last Edited: 9/12/2024
+Last Edited: 10/17/2026
 '''
 
+import os
+import uuid
+import hashlib
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import pandas as pd
-from scipy.cluster.hierarchy import linkage, dendrogram
+import numpy as np
+try:
+    from .data_structuring.dataframe_ops import GroupIndex
+except ImportError:
+    #Imported on its own, with the package directory on sys.path
+    from data_structuring.dataframe_ops import GroupIndex
 
-def get_cluster_within_groups_order(ds, groups_dict):
+def get_cluster_within_groups_order(ds, groups_dict, n_workers=1, pool='process', large_group_size=None,
+                                    memmap_dir=None, approximate_group_size=None, random_state=0, cache=None):
     '''
     Parameters:
     ds - pandas DataFrame - dataset to be clustered with group members in column names
     groups_dict - Python dict - keys are groups, values are lists of group members
                                 Can use output from data.structuring.dataframe_ops get_group_members
+                                or a GroupIndex, whose members are then taken by position
+    n_workers - int - number of groups clustered at the same time. 1 clusters them one after
+                      the other, None uses the number of processors
+    pool - string - "process" or "thread", the kind of pool used when n_workers is not 1.
+                    Processes copy each group's data to a worker, threads share it
+    large_group_size - int - groups with more members get their correlation distances from
+                             blockwise float32 matrix products instead of scipy's pairwise loop.
+                             The order can differ from the default where distances tie within
+                             float32 precision. None never does
+    memmap_dir - string - directory in which large groups keep their distances in a memory
+                          mapped file instead of memory. linkage still makes its own copy in
+                          memory, so this halves the peak
+    approximate_group_size - int - groups with more members are ordered approximately: that many
+                                   randomly chosen members are clustered, every member is assigned
+                                   to its most correlated chosen member, and the members assigned to
+                                   each chosen member are clustered in the chosen members' order.
+                                   Memory then grows with approximate_group_size squared instead of
+                                   the group size squared. None never does
+    random_state - int - seed used to choose the members of approximately ordered groups
+    cache - LinkageCache - if given, groups whose values and options were clustered before reuse
+                           the stored linkage and leaf order, and only new or changed groups are
+                           clustered
 
+    The order is the same whatever n_workers and pool.
     '''
+    if not pool in ['process', 'thread']:
+        raise AssertionError(
+                "pool must be \"process\" or \"thread\""
+                )
+
+    options = {'large_group_size': large_group_size, 'memmap_dir': memmap_dir,
+               'approximate_group_size': approximate_group_size, 'random_state': random_state}
+
     #Group members must be in columns of ds
-    order = []
-    for group in groups_dict:
-        group_ds = ds.loc[:, groups_dict[group]]
+    if isinstance(groups_dict, GroupIndex) and ds.columns.is_unique:
+        columns = ds.columns.get_indexer(groups_dict.labels)
+        if (columns < 0).any():
+            raise KeyError("members of groups_dict missing from the columns of ds")
+        group_dss = [ds.iloc[:, columns[groups_dict.positions(group)]] for group in groups_dict]
+    else:
+        group_dss = [ds.loc[:, groups_dict[group]] for group in groups_dict]
+    values = [(group_ds.T.to_numpy(dtype=float), options) for group_ds in group_dss]
+
+    group_orders = [None]*len(values)
+    if cache is not None:
+        keys = [cache.key(*i) for i in values]
+        for i, key in enumerate(keys):
+            cached = cache.get(key)
+            if cached is not None:
+                group_orders[i] = cached[1]
+    missing = [i for i, group_order in enumerate(group_orders) if group_order is None]
 
-        #Calculate linkage
-        l = linkage(group_ds.T, "average", metric = "correlation")
+    if n_workers == 1:
+        results = list(map(_cluster_group, [values[i] for i in missing]))
+    else:
+        executor = ProcessPoolExecutor if pool == 'process' else ThreadPoolExecutor
+        with executor(max_workers=n_workers) as e:
+            results = list(e.map(_cluster_group, [values[i] for i in missing]))
 
-        group_order = dendrogram(l, no_plot = True)["leaves"]
+    for i, result in zip(missing, results):
+        group_orders[i] = result[1]
+        if cache is not None:
+            cache.put(keys[i], *result)
 
+    order = []
+    for group_ds, group_order in zip(group_dss, group_orders):
         order+=list(group_ds.iloc[:, group_order].columns)
 
     return order
+
+class LinkageCache:
+    '''
+    Size bounded LRU cache of the linkage matrix and leaf order of each group clustered by
+    get_cluster_within_groups_order, keyed on a hash of the group's values and the clustering
+    options. Kept in memory, and on disk if cache_dir is given so it lasts between sessions.
+
+    max_entries - int - number of groups kept in memory
+    cache_dir - string - directory to also keep the groups in, as .npz files
+    max_bytes - int - size of cache_dir over which the least recently used files are removed
+
+    Processes can share cache_dir, a group evicted by one is clustered again by the others.
+    '''
+
+    def __init__(self, max_entries=256, cache_dir=None, max_bytes=2**30):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, values, options):
+        '''
+        Returns string hash of a group's values (members by features) and clustering options
+        '''
+        values = np.ascontiguousarray(values, dtype=float)
+        settings = {i: options[i] for i in options if i != 'memmap_dir'}
+        h = hashlib.sha1(repr(("average", "correlation", values.shape, sorted(settings.items()))).encode())
+        h.update(values.tobytes())
+        return h.hexdigest()
+
+    def get(self, key):
+        '''
+        Returns tuple of linkage matrix (None for approximately ordered groups) and leaf order,
+        or None if key is not cached
+        '''
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits+=1
+            return self._entries[key]
+
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, key+'.npz')
+            try:
+                with np.load(path) as archive:
+                    value = (archive['linkage'] if 'linkage' in archive else None, list(archive['leaves']))
+            except FileNotFoundError:
+                #Not cached, or evicted by another process sharing cache_dir
+                value = None
+            if value is not None:
+                #Modification time orders the files for eviction
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+                self._remember(key, value)
+                self.hits+=1
+                return value
+
+        self.misses+=1
+        return None
+
+    def put(self, key, l, leaves):
+        '''
+        Stores the linkage matrix (or None) and leaf order of a group
+        '''
+        value = (l, list(leaves))
+        self._remember(key, value)
+
+        if self.cache_dir is not None:
+            arrays = {'leaves': np.asarray(leaves, dtype=np.int64)}
+            if l is not None:
+                arrays['linkage'] = l
+            path = os.path.join(self.cache_dir, key+'.npz')
+            #Write through a file object so numpy does not append its own extension, to a file of
+            #this call's own moved into place so readers never see a partial file, even when
+            #processes sharing cache_dir write the same group at once
+            temp = path+'.'+uuid.uuid4().hex+'.tmp'
+            try:
+                with open(temp, 'xb') as f:
+                    np.savez(f, **arrays)
+                os.replace(temp, path)
+            except BaseException:
+                _remove(temp)
+                raise
+            self._evict_files()
+
+    def clear(self):
+        '''
+        Removes every group from memory and cache_dir
+        '''
+        self._entries.clear()
+        if self.cache_dir is not None:
+            for i in os.listdir(self.cache_dir):
+                if i.endswith('.npz'):
+                    _remove(os.path.join(self.cache_dir, i))
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _evict_files(self):
+        files = []
+        for i in os.listdir(self.cache_dir):
+            if i.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, i))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, i))
+        files.sort()
+        total = sum(i[1] for i in files)
+        for mtime, size, i in files:
+            if total <= self.max_bytes:
+                break
+            _remove(os.path.join(self.cache_dir, i))
+            total-=size
+
+def _remove(path):
+    '''
+    Internal function removing a file, if another process sharing the cache has not already
+    '''
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _cluster_group(args):
+    '''
+    Internal function returning the average linkage clustering (correlation distance) of the rows
+    of values and its leaf order, the same order as dendrogram(..., no_plot = True)["leaves"].
+    The linkage is None for groups ordered approximately or with fewer than 2 members
+
+    args - tuple of numpy array of values and dict of options of get_cluster_within_groups_order
+    '''
+    #Imported here so importing the module does not load scipy's clustering
+    from scipy.cluster.hierarchy import linkage, leaves_list
+
+    values, options = args
+    if len(values) < 2:
+        return None, list(range(len(values)))
+
+    if options['approximate_group_size'] is not None and len(values) > options['approximate_group_size']:
+        return None, _approximate_leaves(values, options)
+
+    #Calculate linkage
+    if options['large_group_size'] is not None and len(values) > options['large_group_size']:
+        l = linkage(_correlation_distances(values, options['memmap_dir']), "average")
+    else:
+        l = linkage(values, "average", metric = "correlation")
+
+    return l, list(leaves_list(l))
+
+def _cluster_leaves(args):
+    '''
+    Internal function returning the leaf order of _cluster_group
+    '''
+    return _cluster_group(args)[1]
+
+def _approximate_leaves(values, options, block_size=1024):
+    '''
+    Internal function that orders the rows of a large group by clustering a random subset of
+    rows and then the rows most correlated with each row of the subset
+    '''
+    n_chosen = options['approximate_group_size']
+    rng = np.random.default_rng(options['random_state'])
+    chosen = np.sort(rng.choice(len(values), n_chosen, replace=False))
+    chosen = chosen[_cluster_leaves((values[chosen], dict(options, approximate_group_size=None)))]
+
+    #Most correlated chosen row of each row
+    z = _standardize(values)
+    z_chosen = z[chosen]
+    nearest = np.empty(len(values), dtype=np.int64)
+    for start in range(0, len(values), block_size):
+        nearest[start:start+block_size] = np.argmax(z[start:start+block_size]@z_chosen.T, axis=1)
+
+    members = np.argsort(nearest, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(nearest, minlength=n_chosen))])
+    order = []
+    for i in range(n_chosen):
+        rows = members[bounds[i]:bounds[i+1]]
+        if len(rows) == len(values):
+            #Every row went to the same chosen row, clustering them again would not end
+            order+=list(rows)
+        else:
+            order+=list(rows[_cluster_leaves((values[rows], options))])
+    return order
+
+def _standardize(values):
+    '''
+    Internal function that centers and scales each row to unit norm in float32, so correlations
+    are dot products. Constant rows become zeros (distance 1 to every row)
+    '''
+    z = np.asarray(values, dtype=np.float32)
+    z = z-z.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(z, axis=1, keepdims=True)
+    norms[norms == 0] = np.inf
+    return z/norms
+
+def _correlation_distances(values, memmap_dir=None, block_size=1024):
+    '''
+    Internal function returning the condensed correlation distance matrix (as from pdist) of the
+    rows of values, block_size rows at a time
+
+    memmap_dir - string - if given the distances are kept in a temporary memory mapped file
+    '''
+    z = _standardize(values)
+    n = len(z)
+    size = n*(n-1)//2
+    if memmap_dir is None:
+        distances = np.empty(size)
+    else:
+        distances = np.memmap(tempfile.TemporaryFile(dir=memmap_dir), dtype=np.float64, mode='w+', shape=(size,))
+
+    for start in range(0, n, block_size):
+        stop = min(start+block_size, n)
+        block = 1-z[start:stop]@z[start:].T
+        np.clip(block, 0, 2, out=block)
+        for i in range(start, stop):
+            offset = n*i-i*(i+1)//2
+            distances[offset:offset+n-i-1] = block[i-start, i-start+1:]
+    return distances
@@ -0,0 +1,30 @@
+import importlib
+
+#Submodules, and public names with the submodule defining each, imported on first use (PEP 562)
+_SUBMODULES = ['dataframe_ops', 'iterables']
+_PUBLIC = {
+    'get_group_members': 'dataframe_ops',
+    'GroupIndex': 'dataframe_ops',
+    'intersection': 'iterables',
+    'find_duplicates': 'iterables',
+    'intersect_arrays': 'iterables',
+    'union_counts': 'iterables',
+    'duplicate_counts': 'iterables',
+    'first_positions': 'iterables',
+    'find_duplicates_external': 'iterables',
+    }
+__all__ = sorted(set(_SUBMODULES) | set(_PUBLIC))
+
+def __getattr__(name):
+    if name in _PUBLIC:
+        value = getattr(importlib.import_module(__name__+'.'+_PUBLIC[name]), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module(__name__+'.'+name)
+    else:
+        raise AttributeError("module "+repr(__name__)+" has no attribute "+repr(name))
+    #Later accesses find the name without calling __getattr__
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return __all__
@@ -1,8 +1,9 @@
 import pandas as pd
 import numpy as np
+from collections.abc import Mapping
 
 def get_group_members(s):
-    ''' 
+    '''
     Parameters:
     s - pandas Series - index is group members, values are groups
 
@@ -10,10 +11,58 @@ def get_group_members(s):
     Python dict with groups as keys and lists of group members per group as values
     '''
 
-    group_members = {}
-    groups = list(set(s.values))
-    groups.sort()
+    return GroupIndex(s).to_dict()
+
+class GroupIndex(Mapping):
+    '''
+    Groups of a pandas Series built in one pass: integer group codes, group offsets and the
+    positions of each group's members, with groups sorted. Reads like the dict returned by
+    get_group_members (groups as keys, lists of members as values), and positions() gives
+    members by position for slicing with iloc/numpy without label lookups.
+
+    s - pandas Series - index is group members, values are groups. Members with missing
+        groups (NaN) are left out
+    '''
+
+    def __init__(self, s):
+        self.labels = s.index
+        self.codes, self.groups = pd.factorize(s, sort=True)
+
+        #Positions of the members of group i are order[offsets[i]:offsets[i+1]], in the order of s
+        self.order = np.argsort(self.codes, kind='stable')[np.count_nonzero(self.codes < 0):]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(self.codes[self.codes >= 0],
+                                                                  minlength=len(self.groups)))])
+
+    def positions(self, group):
+        '''
+        Returns numpy array of the positions of a group's members in s
+        '''
+        i = self.groups.get_loc(group)
+        return self.order[self.offsets[i]:self.offsets[i+1]]
+
+    def sizes(self):
+        '''
+        Returns pandas Series of the number of members of each group
+        '''
+        return pd.Series(np.diff(self.offsets), index=self.groups)
+
+    def to_dict(self):
+        '''
+        Returns Python dict with groups as keys and lists of group members as values
+        '''
+        members = self.labels[self.order]
+        return {group: list(members[self.offsets[i]:self.offsets[i+1]]) for i, group in enumerate(self.groups)}
+
+    def __getitem__(self, group):
+        if not group in self.groups:
+            raise KeyError(group)
+        return list(self.labels[self.positions(group)])
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __len__(self):
+        return len(self.groups)
 
-    for group in groups:
-        group_members[group] = list(s.loc[s==group].index)
-    return group_members
+    def __contains__(self, group):
+        return group in self.groups
@@ -1,3 +1,8 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
 def intersection(it1, it2):
     '''
     Return list of intersecting elements. (Tired of writing this code out)
@@ -23,3 +28,104 @@ def find_duplicates(x):
            a.add(element)
 
     return (list(repeated))
+
+def intersect_arrays(*arrays):
+    '''
+    Return numpy array of the elements found in every input, in order of first appearance
+    in the first input
+
+    arrays - array-likes (lists, numpy arrays, pandas Series)
+    '''
+    if not arrays:
+        return np.array([], dtype=object)
+
+    result = pd.Index(pd.unique(_as_array(arrays[0])))
+    for array in arrays[1:]:
+        result = result[result.isin(pd.unique(_as_array(array)))]
+    return result.to_numpy()
+
+def union_counts(*arrays, occurrences=False):
+    '''
+    Return pandas Series with every element of the inputs as index, in order of first
+    appearance, and the number of inputs containing it as values
+
+    arrays - array-likes (lists, numpy arrays, pandas Series)
+    occurrences - if True count every occurrence instead of the inputs containing the element
+    '''
+    if occurrences:
+        values = [_as_array(array) for array in arrays]
+    else:
+        values = [pd.unique(_as_array(array)) for array in arrays]
+    if not values:
+        return pd.Series([], dtype=np.int64)
+    return pd.Series(np.concatenate(values)).value_counts(sort=False, dropna=False).rename(None)
+
+def duplicate_counts(x):
+    '''
+    Return pandas Series with the elements appearing more than once as index, in order of first
+    appearance, and their number of occurrences as values
+
+    x - array-like
+    '''
+    counts = pd.Series(_as_array(x)).value_counts(sort=False, dropna=False).rename(None)
+    return counts.loc[counts.to_numpy() > 1]
+
+def first_positions(x):
+    '''
+    Return pandas Series with each distinct element as index, in order of first appearance,
+    and the position of its first occurrence as values
+
+    x - array-like
+    '''
+    codes, uniques = pd.factorize(_as_array(x), use_na_sentinel=False)
+    return pd.Series(np.unique(codes, return_index=True)[1], index=uniques)
+
+def find_duplicates_external(chunks, tmp_dir=None, n_partitions=64):
+    '''
+    Return pandas Series with the elements appearing more than once as index, sorted, and
+    their number of occurrences as values, for inputs larger than memory. Elements are
+    compared as strings and must not contain newlines.
+
+    Every chunk is spread over n_partitions files on disk by the hash of its elements, so
+    equal elements land in the same file, then the files are counted one at a time. Memory
+    is bounded by the largest chunk and the largest partition.
+
+    chunks - iterable of array-likes, ex. a generator over many files or
+             pd.read_csv(..., usecols=[column], chunksize=1000000)
+    tmp_dir - directory for the partition files, defaults to the system temporary directory
+    n_partitions - number of partition files
+    '''
+    duplicates = []
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as directory:
+        paths = [os.path.join(directory, str(i)) for i in range(n_partitions)]
+        files = [open(path, 'w') for path in paths]
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, pd.DataFrame):
+                    chunk = chunk.iloc[:, 0]
+                values = pd.Series(_as_array(chunk)).astype(str).to_numpy(dtype=object)
+                partitions = pd.util.hash_array(values) % n_partitions
+                order = np.argsort(partitions, kind='stable')
+                bounds = np.searchsorted(partitions[order], np.arange(n_partitions+1))
+                for i in np.flatnonzero(np.diff(bounds)):
+                    files[i].write('\n'.join(values[order[bounds[i]:bounds[i+1]]])+'\n')
+        finally:
+            for f in files:
+                f.close()
+
+        for path in paths:
+            with open(path) as f:
+                counts = duplicate_counts(f.read().split('\n')[:-1])
+            duplicates.append(counts)
+
+    return pd.concat(duplicates).sort_index()
+
+def _as_array(x):
+    '''
+    Internal function that turns an array-like into a one dimensional numpy array
+    '''
+    if isinstance(x, (pd.Series, pd.Index)):
+        return x.to_numpy()
+    if isinstance(x, np.ndarray):
+        return x.ravel()
+    return np.asarray(list(x), dtype=object)
@@ -0,0 +1,32 @@
+import importlib
+
+#Submodules, and public names with the submodule defining each, imported on first use (PEP 562)
+_SUBMODULES = ['bit_matrix', 'gene_key', 'gmt', 'progress', 'reformat_maf']
+_PUBLIC = {
+    'produce_variant_file': 'reformat_maf',
+    'produce_merged_variant_file': 'reformat_maf',
+    'produce_copy_number_file': 'reformat_maf',
+    'read_variant_matrix': 'reformat_maf',
+    'GeneKey': 'gene_key',
+    'BitMatrix': 'bit_matrix',
+    'iter_gmt': 'gmt',
+    'GeneSets': 'gmt',
+    'enrichment': 'gmt',
+    'ProgressReporter': 'progress',
+    'reporting': 'progress',
+    }
+__all__ = sorted(set(_SUBMODULES) | set(_PUBLIC))
+
+def __getattr__(name):
+    if name in _PUBLIC:
+        value = getattr(importlib.import_module(__name__+'.'+_PUBLIC[name]), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module(__name__+'.'+name)
+    else:
+        raise AttributeError("module "+repr(__name__)+" has no attribute "+repr(name))
+    #Later accesses find the name without calling __getattr__
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return __all__
@@ -0,0 +1,271 @@
+'''
+Bit packed binary mutation matrix with co-occurrence queries, built from the output of
+reformat_maf.produce_variant_file
+
+Author: Stephanie Ting
+Stephanie.Ting.3@gmail.com
+
+Last edited:
+10/17/2026
+'''
+
+import pandas as pd
+import numpy as np
+from scipy import sparse
+from .reformat_maf import produce_variant_file, read_variant_matrix
+
+#Bytes of the largest temporary array made by a single step
+_BLOCK_BYTES=2**26
+
+if hasattr(np, 'bitwise_count'):
+    _popcount=np.bitwise_count
+else:
+    _BYTE_COUNTS=np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    def _popcount(words):
+        return _BYTE_COUNTS[words.view(np.uint8)].reshape(words.shape+(8,)).sum(axis=-1, dtype=np.uint8)
+
+class BitMatrix:
+    '''
+    Binary features by samples matrix stored as one packed bit array per feature, 64 samples
+    per word. Queries are done with bitwise operations and popcounts on whole words.
+
+    Build it from the output of produce_variant_file with from_maf, read, from_sparse or
+    from_dataframe.
+    '''
+
+    def __init__(self, bits, features, samples):
+        '''
+        bits - numpy uint64 array of features by words, sample j is bit j%64 of word j//64
+        features - list-like of feature names
+        samples - list-like of sample names
+        '''
+        self.bits=bits
+        self.features=pd.Index(features, dtype=object)
+        self.samples=pd.Index(samples, dtype=object)
+
+    @classmethod
+    def from_sparse(cls, matrix, features, samples):
+        '''
+        matrix - scipy.sparse matrix with features as rows and samples as columns. Non zero
+                 entries are set
+        '''
+        matrix=sparse.csr_matrix(matrix)
+        n_words=-(-matrix.shape[1]//64)
+        bits=np.zeros((matrix.shape[0], n_words), dtype=np.uint64)
+
+        #Unpack a block of rows at a time to bound memory
+        block=max(1, _BLOCK_BYTES//max(1, n_words*64))
+        for start in range(0, matrix.shape[0], block):
+            dense=np.zeros((min(block, matrix.shape[0]-start), n_words*64), dtype=bool)
+            dense[:, :matrix.shape[1]]=matrix[start:start+block].toarray()!=0
+            bits[start:start+len(dense)]=np.packbits(dense, axis=1, bitorder='little').view(np.uint64)
+        return cls(bits, features, samples)
+
+    @classmethod
+    def from_dataframe(cls, ds):
+        '''
+        ds - pandas DataFrame of 0s and 1s with features as index and samples as columns
+        '''
+        return cls.from_sparse(sparse.csr_matrix(ds.to_numpy()!=0), ds.index, ds.columns)
+
+    @classmethod
+    def read(cls, input_file, output_format='sparse_binary_matrix'):
+        '''
+        Reads a file written by produce_variant_file
+
+        output_format - string - output_format the file was written with, see read_variant_matrix
+        '''
+        return cls.from_sparse(*read_variant_matrix(input_file, output_format))
+
+    @classmethod
+    def from_maf(cls, maf_input_file, output_file, output_format='npz', **kwargs):
+        '''
+        Runs produce_variant_file and builds the matrix from its output
+
+        output_file - string - file path the output of produce_variant_file is written to
+        kwargs - other parameters of produce_variant_file
+        '''
+        return cls._from_output(produce_variant_file(maf_input_file, output_file,
+                                                     output_format=output_format, **kwargs))
+
+    @classmethod
+    def _from_output(cls, output):
+        if isinstance(output, pd.DataFrame):
+            return cls.from_dataframe(output)
+
+        elif isinstance(output, dict):
+            features=list(output)
+            samples=pd.Index(list(dict.fromkeys(i for feature in features for i in output[feature])))
+            rows=np.repeat(np.arange(len(features)), [len(output[i]) for i in features])
+            cols=samples.get_indexer([i for feature in features for i in output[feature]])
+            matrix=sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                                     shape=(len(features), len(samples)))
+            return cls.from_sparse(matrix, features, samples)
+
+        return cls.from_sparse(*output)
+
+    def to_sparse(self):
+        '''
+        Returns scipy.sparse CSR matrix of int8 with features as rows and samples as columns
+        '''
+        block=max(1, _BLOCK_BYTES//max(1, self.bits.shape[1]*64))
+        blocks=[]
+        for start in range(0, len(self.features), block):
+            dense=np.unpackbits(self.bits[start:start+block].view(np.uint8), axis=1, bitorder='little')
+            blocks.append(sparse.csr_matrix(dense[:, :len(self.samples)].astype(np.int8)))
+        if not blocks:
+            return sparse.csr_matrix((0, len(self.samples)), dtype=np.int8)
+        return sparse.vstack(blocks, format='csr')
+
+    def counts(self, features=None):
+        '''
+        Returns pandas Series of the number of samples with each feature
+        '''
+        rows=self._rows(features)
+        return pd.Series(_popcount(self.bits[rows]).sum(axis=1, dtype=np.int64),
+                         index=self.features[rows], name='samples')
+
+    def burden(self, features=None):
+        '''
+        Returns pandas Series of the number of features (out of features, defaults to all) each
+        sample has
+        '''
+        rows=self._rows(features)
+        totals=np.zeros(self.bits.shape[1]*64, dtype=np.int64)
+        block=max(1, _BLOCK_BYTES//max(1, self.bits.shape[1]*64))
+        for start in range(0, len(rows), block):
+            totals+=np.unpackbits(self.bits[rows[start:start+block]].view(np.uint8), axis=1,
+                                  bitorder='little').sum(axis=0, dtype=np.int64)
+        return pd.Series(totals[:len(self.samples)], index=self.samples, name='burden')
+
+    def any_of(self, features):
+        '''
+        Returns boolean pandas Series of samples with at least one of features
+        '''
+        return self._samples_series(np.bitwise_or.reduce(self.bits[self._rows(features)], axis=0,
+                                                         initial=np.uint64(0)))
+
+    def all_of(self, features):
+        '''
+        Returns boolean pandas Series of samples with every one of features
+        '''
+        return self._samples_series(np.bitwise_and.reduce(self.bits[self._rows(features)], axis=0,
+                                                          initial=~np.uint64(0)))
+
+    def cooccurrence(self, features=None, other_features=None):
+        '''
+        Counts the samples with both features of every pair
+
+        features - list of feature names for the rows, defaults to all features
+        other_features - list of feature names for the columns, defaults to features
+
+        Returns pandas DataFrame of counts with features as index and other_features as columns
+        '''
+        rows=self._rows(features)
+        cols=rows if other_features is None else self._rows(other_features)
+        b=self._unpack(cols)
+
+        #One matrix product per block of rows, exact while counts fit in float32's 24 bits
+        counts=np.empty((len(rows), len(cols)), dtype=np.int64)
+        block=max(1, _BLOCK_BYTES//max(1, max(len(cols), self.bits.shape[1]*64)*4))
+        for start in range(0, len(rows), block):
+            counts[start:start+block]=self._unpack(rows[start:start+block])@b.T
+        return pd.DataFrame(counts, index=self.features[rows], columns=self.features[cols])
+
+    def sparse_cooccurrence(self, features=None):
+        '''
+        Counts the samples with both features of every co-occurring pair, from a sparse product,
+        which handles tens of thousands of features. Pairs missing from the matrix have no
+        samples in common, so mutually exclusive pairs can be found from it on demand
+
+        features - list of feature names, defaults to all features
+
+        Returns tuple of pandas Series of the number of samples with each feature and scipy.sparse
+        CSR matrix of int64 counts with features as rows and columns, in the order of the Series
+        '''
+        rows=self._rows(features)
+        matrix=sparse.csr_matrix(self.to_sparse()[rows], dtype=np.int32)
+        product=sparse.csr_matrix(matrix@matrix.T, dtype=np.int64)
+        product.sort_indices()
+        return pd.Series(product.diagonal(), index=self.features[rows], name='samples'), product
+
+    def contingency(self, features=None, min_both=1, max_both=None, min_count=0):
+        '''
+        Builds the 2x2 contingency table of every pair of features, for co-occurrence and
+        mutual exclusivity tests. Pairs are counted from sparse_cooccurrence and filtered before
+        the table is built
+
+        features - list of feature names, defaults to all features
+        min_both - int - only pairs with at least min_both samples with both features are returned.
+            With the default 1 only co-occurring pairs are looked at. With 0 every pair is looked
+            at, so the time grows with the square of the number of features
+        max_both - int - only pairs with at most max_both samples with both features are returned,
+            ex. 0 with min_both 0 for mutually exclusive pairs. None has no maximum
+        min_count - int - only features with at least min_count samples are paired, which keeps
+            mutual exclusivity tables of many features to the pairs that can be tested
+
+        Returns pandas DataFrame with one row per pair of features (feature_a before feature_b
+        in features) and columns 'feature_a', 'feature_b', 'both', 'a_only', 'b_only', 'neither'
+        '''
+        rows=self._rows(features)
+        if min_count>0:
+            rows=rows[_popcount(self.bits[rows]).sum(axis=1, dtype=np.int64)>=min_count]
+        counts, product=self.sparse_cooccurrence(self.features[rows])
+        counts=counts.to_numpy()
+        max_both=np.inf if max_both is None else max_both
+
+        if min_both>=1:
+            a=np.repeat(np.arange(len(rows)), np.diff(product.indptr))
+            keep=(product.indices>a)&(product.data>=min_both)&(product.data<=max_both)
+            a, b, both=a[keep], product.indices[keep], product.data[keep]
+        else:
+            #Every pair, a block of rows of the product at a time
+            pairs=[]
+            block=max(1, _BLOCK_BYTES//max(1, len(rows)*8))
+            for start in range(0, len(rows), block):
+                dense=product[start:start+block].toarray()
+                keep=(np.arange(len(rows))[None, :]>np.arange(start, start+len(dense))[:, None])& \
+                    (dense>=min_both)&(dense<=max_both)
+                block_a, block_b=np.nonzero(keep)
+                pairs.append((block_a+start, block_b, dense[block_a, block_b]))
+            a, b, both=[np.concatenate([i[j] for i in pairs]) if pairs else np.empty(0, dtype=np.int64)
+                        for j in range(3)]
+
+        names=np.asarray(self.features[rows], dtype=object)
+        return pd.DataFrame({
+            'feature_a': names[a],
+            'feature_b': names[b],
+            'both': both,
+            'a_only': counts[a]-both,
+            'b_only': counts[b]-both,
+            'neither': len(self.samples)-counts[a]-counts[b]+both})
+
+    def _rows(self, features):
+        '''
+        Internal function returning the row of each feature name, or every row if features is None
+        '''
+        if features is None:
+            return np.arange(len(self.features))
+        if isinstance(features, str):
+            features=[features]
+        features=pd.Index(list(features), dtype=object)
+        rows=self.features.get_indexer(features)
+        if (rows<0).any():
+            raise AssertionError(
+                    "features not found: "+", ".join(map(str, features[rows<0][:10]))
+                    )
+        return rows
+
+    def _unpack(self, rows):
+        '''
+        Internal function returning the features of rows as a float32 array of 0s and 1s over samples
+        '''
+        dense=np.unpackbits(self.bits[rows].view(np.uint8), axis=1, bitorder='little')
+        return dense[:, :len(self.samples)].astype(np.float32)
+
+    def _samples_series(self, words):
+        '''
+        Internal function that unpacks one bit array to a boolean pandas Series over samples
+        '''
+        bits=np.unpackbits(np.atleast_1d(words).view(np.uint8), bitorder='little')
+        return pd.Series(bits[:len(self.samples)].astype(bool), index=self.samples)
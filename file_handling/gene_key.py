@@ -0,0 +1,157 @@
+'''
+Translation index from gene identifiers to gene names, built from an Ensembl key file
+(tab separated, with a 'Gene name' column and one column per identifier format)
+'''
+
+import warnings
+import hashlib
+import pandas as pd
+import numpy as np
+from .npz import _savez
+
+FORMATS=['Gene stable ID', 'Gene stable ID version', 'Transcript stable ID',
+         'Transcript stable ID version', 'Gene name']
+
+class GeneKey:
+    '''
+    Maps gene identifiers of every format in an Ensembl key file to gene names with hashed,
+    vectorized lookups. Build it once with GeneKey.from_key_file, save it and reload it with
+    GeneKey.load, and pass it as key_file to produce_variant_file.
+
+    Identifiers mapping to more than one gene name (ambiguous) are left out of the translation.
+    When several identifiers map to the same gene name (many to one) only the first one in the
+    key file is kept, as produce_variant_file always did. Both cases are reported with a warning
+    and can be listed with ambiguous() and many_to_one().
+    '''
+
+    def __init__(self, pairs):
+        '''
+        pairs - dict with identifier formats as keys and pandas DataFrames with 'id' and 'name'
+                columns of unique pairs, in key file order, as values
+        '''
+        self.pairs=pairs
+        self._series={}
+
+    @classmethod
+    def from_key_file(cls, key_file, gene_identifier_formats=None):
+        '''
+        key_file - string - path to the key file
+        gene_identifier_formats - list of identifier formats to index, defaults to every format
+                                  in FORMATS found in the key file
+        '''
+        if gene_identifier_formats is None:
+            header=pd.read_csv(key_file, sep='\t', nrows=0).columns
+            gene_identifier_formats=[i for i in FORMATS if i in header]
+
+        key_df=pd.read_csv(key_file, sep='\t', dtype=str,
+                           usecols=lambda column: column in gene_identifier_formats or column=='Gene name')
+
+        pairs={}
+        for gene_identifier_format in gene_identifier_formats:
+            format_pairs=key_df.loc[:, [gene_identifier_format, 'Gene name']].dropna()
+            format_pairs.columns=['id', 'name']
+            pairs[gene_identifier_format]=format_pairs.drop_duplicates().reset_index(drop=True)
+        return cls(pairs)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Loads a GeneKey written by save
+
+        path - string - path to the .npz file
+        '''
+        pairs={}
+        with np.load(path) as archive:
+            for i, gene_identifier_format in enumerate(archive['formats']):
+                pairs[str(gene_identifier_format)]=pd.DataFrame({
+                    'id': archive['ids_'+str(i)].astype(object),
+                    'name': archive['names_'+str(i)].astype(object)})
+        return cls(pairs)
+
+    def save(self, path):
+        '''
+        Writes the index to a numpy .npz file
+
+        path - string - path to the file
+        '''
+        arrays={'formats': np.asarray(list(self.pairs), dtype=str)}
+        for i, format_pairs in enumerate(self.pairs.values()):
+            arrays['ids_'+str(i)]=np.asarray(format_pairs['id'], dtype=str)
+            arrays['names_'+str(i)]=np.asarray(format_pairs['name'], dtype=str)
+
+        _savez(path, **arrays)
+
+    def ambiguous(self, gene_identifier_format):
+        '''
+        Returns pandas DataFrame of the identifier and gene name pairs of identifiers that map
+        to more than one gene name
+        '''
+        format_pairs=self._pairs(gene_identifier_format)
+        return format_pairs.loc[format_pairs['id'].duplicated(keep=False)]
+
+    def many_to_one(self, gene_identifier_format):
+        '''
+        Returns pandas DataFrame of the identifier and gene name pairs of gene names that more
+        than one (unambiguous) identifier maps to
+        '''
+        format_pairs=self._pairs(gene_identifier_format)
+        format_pairs=format_pairs.loc[~format_pairs['id'].duplicated(keep=False)]
+        return format_pairs.loc[format_pairs['name'].duplicated(keep=False)]
+
+    def series(self, gene_identifier_format):
+        '''
+        Returns pandas Series of gene names indexed by unique identifiers
+        '''
+        if not gene_identifier_format in self._series:
+            format_pairs=self._pairs(gene_identifier_format)
+            ambiguous=format_pairs['id'].duplicated(keep=False)
+            n_ambiguous=format_pairs.loc[ambiguous, 'id'].nunique()
+            format_pairs=format_pairs.loc[~ambiguous]
+            many_to_one=format_pairs['name'].duplicated(keep='first')
+
+            if n_ambiguous or many_to_one.any():
+                warnings.warn(
+                        str(n_ambiguous)+" ambiguous identifiers left out and "+str(many_to_one.sum())
+                        +" identifiers of already mapped gene names dropped for format \""
+                        +gene_identifier_format+"\". See GeneKey.ambiguous and GeneKey.many_to_one"
+                        )
+
+            format_pairs=format_pairs.loc[~many_to_one]
+            self._series[gene_identifier_format]=pd.Series(
+                    format_pairs['name'].to_numpy(), index=pd.Index(format_pairs['id'].to_numpy(), dtype=object),
+                    name='Gene name')
+        return self._series[gene_identifier_format]
+
+    def translate(self, values, gene_identifier_format):
+        '''
+        Translates identifiers to gene names
+
+        values - list-like of identifiers
+
+        Returns numpy array of gene names, NaN where the identifier is not in the index
+        '''
+        positions=self.series(gene_identifier_format).index.get_indexer(values)
+        names=np.append(self.series(gene_identifier_format).to_numpy(dtype=object), np.nan)
+        return names[positions]
+
+    def contains(self, values, gene_identifier_format):
+        '''
+        values - list-like of identifiers
+
+        Returns boolean numpy array, True where the identifier can be translated
+        '''
+        return self.series(gene_identifier_format).index.get_indexer(values)>=0
+
+    def digest(self, gene_identifier_format):
+        '''
+        Returns string hash of the translation of one format, to key caches on
+        '''
+        hashes=pd.util.hash_pandas_object(self.series(gene_identifier_format), index=True)
+        return hashlib.sha1(hashes.to_numpy().tobytes()).hexdigest()
+
+    def _pairs(self, gene_identifier_format):
+        if not gene_identifier_format in self.pairs:
+            raise AssertionError(
+                    "gene_identifier_format must be one of "+", ".join(self.pairs)
+                    )
+        return self.pairs[gene_identifier_format]
@@ -1 +1,380 @@
+'''
+Reads gene set files in GMT format (ex. MSigDB) into a compact index of gene sets with an
+inverted index from genes to the sets containing them
 
+Each line of a GMT file is a tab separated set name, description and the genes of the set.
+
+Author: Stephanie Ting
+Stephanie.Ting.3@gmail.com
+
+Last edited:
+10/17/2026
+'''
+
+import gzip
+import warnings
+from array import array
+import pandas as pd
+import numpy as np
+from scipy import sparse
+from scipy.special import gammaln
+from .npz import _savez
+
+def iter_gmt(gmt_file):
+    '''
+    Streams a GMT file one gene set at a time
+
+    gmt_file - string - path to the GMT file, gzipped if it ends with .gz
+
+    Yields tuples of set name, description and list of genes. Empty fields and repeated genes
+    are removed, gene order is kept
+    '''
+    opener=gzip.open if str(gmt_file).endswith('.gz') else open
+    with opener(gmt_file, 'rt') as f:
+        for line in f:
+            fields=line.rstrip('\r\n').split('\t')
+            if len(fields)<2 or not fields[0]:
+                continue
+            genes=dict.fromkeys(fields[2:])
+            genes.pop('', None)
+            yield fields[0], fields[1], list(genes)
+
+class GeneSets:
+    '''
+    Gene sets stored as integer gene IDs in flat arrays: the genes of set i are
+    genes[members[set_indptr[i]:set_indptr[i+1]]], and the sets containing gene j are
+    set_names[gene_sets[gene_indptr[j]:gene_indptr[j+1]]]
+
+    Build it with GeneSets.from_gmt, save it and reload it with GeneSets.load.
+    '''
+
+    def __init__(self, set_names, descriptions, set_indptr, members, genes):
+        '''
+        set_names - list-like of gene set names
+        descriptions - list-like of gene set descriptions
+        set_indptr - numpy int64 array of the start of each set in members, plus the end
+        members - numpy int32 array of gene IDs
+        genes - list-like of gene names indexed by gene ID
+        '''
+        self.set_names=np.asarray(set_names, dtype=object)
+        self.descriptions=np.asarray(descriptions, dtype=object)
+        self.set_indptr=np.asarray(set_indptr, dtype=np.int64)
+        self.members=np.asarray(members, dtype=np.int32)
+        self.genes=np.asarray(genes, dtype=object)
+
+        self.gene_ids={gene: i for i, gene in enumerate(self.genes)}
+        self.set_ids={}
+        for i, name in enumerate(self.set_names):
+            self.set_ids.setdefault(name, i)
+
+        #Inverted index, sets of each gene in set order
+        self._membership=None
+        inverted=self.membership().tocsc()
+        self.gene_sets=inverted.indices.astype(np.int32, copy=False)
+        self.gene_indptr=inverted.indptr.astype(np.int64, copy=False)
+
+    @classmethod
+    def from_gmt(cls, gmt_files, min_size=None, max_size=None):
+        '''
+        Reads one or more GMT files, streaming them line by line
+
+        gmt_files - string or list of strings - paths to GMT files (ex. the MSigDB collections)
+        min_size - int - if given sets with fewer genes are skipped
+        max_size - int - if given sets with more genes are skipped
+
+        Sets whose name was already read are skipped with a warning
+        '''
+        if isinstance(gmt_files, str):
+            gmt_files=[gmt_files]
+
+        gene_ids={}
+        set_names=[]
+        descriptions=[]
+        set_indptr=array('q', [0])
+        members=array('i')
+        seen=set()
+        n_repeated=0
+
+        for gmt_file in gmt_files:
+            for name, description, genes in iter_gmt(gmt_file):
+                if min_size is not None and len(genes)<min_size or max_size is not None and len(genes)>max_size:
+                    continue
+                if name in seen:
+                    n_repeated+=1
+                    continue
+                seen.add(name)
+
+                set_names.append(name)
+                descriptions.append(description)
+                #Genes are interned in gene_ids, a single string per gene is kept for all sets
+                new=set(genes).difference(gene_ids)
+                if new:
+                    new=[i for i in genes if i in new]
+                    gene_ids.update(zip(new, range(len(gene_ids), len(gene_ids)+len(new))))
+                members.extend(map(gene_ids.__getitem__, genes))
+                set_indptr.append(len(members))
+
+        if n_repeated:
+            warnings.warn(
+                    str(n_repeated)+" gene sets with repeated names skipped"
+                    )
+
+        return cls(set_names, descriptions, np.frombuffer(set_indptr, dtype=np.int64),
+                   np.frombuffer(members, dtype=np.int32), list(gene_ids))
+
+    @classmethod
+    def from_dict(cls, gene_sets):
+        '''
+        gene_sets - dict with set names as keys and lists of genes as values
+        '''
+        gene_ids={}
+        members=[]
+        for genes in gene_sets.values():
+            members.extend(gene_ids.setdefault(i, len(gene_ids)) for i in dict.fromkeys(genes))
+        sizes=[len(dict.fromkeys(i)) for i in gene_sets.values()]
+        return cls(list(gene_sets), ['']*len(gene_sets), np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]),
+                   np.asarray(members, dtype=np.int32), list(gene_ids))
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Loads GeneSets written by save
+
+        path - string - path to the .npz file
+        '''
+        with np.load(path) as archive:
+            return cls(archive['set_names'].astype(object), archive['descriptions'].astype(object),
+                       archive['set_indptr'], archive['members'], archive['genes'].astype(object))
+
+    def save(self, path):
+        '''
+        Writes the gene sets to a numpy .npz file
+
+        path - string - path to the file
+        '''
+        _savez(path, set_names=self.set_names.astype(str), descriptions=self.descriptions.astype(str),
+               set_indptr=self.set_indptr, members=self.members, genes=self.genes.astype(str))
+
+    def __len__(self):
+        return len(self.set_names)
+
+    def __contains__(self, set_name):
+        return set_name in self.set_ids
+
+    def sizes(self):
+        '''
+        Returns pandas Series of the number of genes in each set
+        '''
+        return pd.Series(np.diff(self.set_indptr), index=self.set_names, name='size')
+
+    def members_of(self, set_name):
+        '''
+        Returns list of the genes of a set
+        '''
+        if not set_name in self.set_ids:
+            raise AssertionError(
+                    "gene set \""+str(set_name)+"\" not found"
+                    )
+        i=self.set_ids[set_name]
+        return list(self.genes[self.members[self.set_indptr[i]:self.set_indptr[i+1]]])
+
+    def sets_containing(self, gene):
+        '''
+        Returns list of the names of the sets containing gene, empty if no set contains it
+        '''
+        if not gene in self.gene_ids:
+            return []
+        j=self.gene_ids[gene]
+        return list(self.set_names[self.gene_sets[self.gene_indptr[j]:self.gene_indptr[j+1]]])
+
+    def to_dict(self):
+        '''
+        Returns dict with set names as keys and lists of genes as values
+        '''
+        genes=self.genes[self.members]
+        return {name: list(genes[self.set_indptr[i]:self.set_indptr[i+1]])
+                for i, name in enumerate(self.set_names) if self.set_ids[name]==i}
+
+    def membership(self):
+        '''
+        Returns scipy.sparse CSR matrix of int8 with sets as rows and gene IDs as columns
+        '''
+        if self._membership is None:
+            self._membership=sparse.csr_matrix(
+                    (np.ones(len(self.members), dtype=np.int8), self.members.copy(), self.set_indptr.copy()),
+                    shape=(len(self.set_names), len(self.genes)))
+            self._membership.sort_indices()
+        return self._membership
+
+    def write_gmt(self, gmt_file):
+        '''
+        Writes the gene sets in GMT format
+
+        gmt_file - string - path to the file
+        '''
+        genes=self.genes[self.members]
+        with open(gmt_file, 'w') as f:
+            for i, name in enumerate(self.set_names):
+                f.write('\t'.join([name, self.descriptions[i]]+list(genes[self.set_indptr[i]:self.set_indptr[i+1]]))+'\n')
+
+def enrichment(queries, gene_sets, background=None, min_overlap=1, min_size=None, max_size=None,
+               return_genes=False):
+    """
+    Tests every query gene list against every gene set at once with the hypergeometric test,
+    and corrects the p-values of each query for the number of sets (Benjamini-Hochberg)
+
+    Parameters:
+
+        queries - list of genes, or dict with query names as keys and lists of genes as values
+
+        gene_sets - GeneSets, dict with set names as keys and lists of genes as values, or path(s)
+            to GMT files
+
+        background - list of genes - genes that could have been in a query. Defaults to every gene
+            in gene_sets. Genes of the queries and sets outside of the background are ignored
+
+        min_overlap - int - only pairs with at least min_overlap genes in common are returned.
+            Every set is still counted in the FDR correction
+
+        min_size, max_size - int - if given only sets with at least/at most this many genes in the
+            background are tested
+
+        return_genes - boolean - if true adds a column with the list of overlapping genes
+
+    Returns:
+        pandas DataFrame with one row per query and gene set sorted by query and p-value, with
+        columns 'query', 'gene_set', 'overlap', 'query_size', 'set_size', 'background_size',
+        'p_value' and 'fdr'
+    """
+
+    if not isinstance(gene_sets, GeneSets):
+        gene_sets=GeneSets.from_dict(gene_sets) if isinstance(gene_sets, dict) else GeneSets.from_gmt(gene_sets)
+    if not isinstance(queries, dict):
+        queries={'query': queries}
+
+    #Genes of the background missing from every set still count in its size
+    genes=pd.Index(gene_sets.genes)
+    if background is None:
+        in_background=np.ones(len(genes), dtype=bool)
+        background_size=len(genes)
+    else:
+        background=pd.Index(pd.unique(np.asarray(list(background), dtype=object)))
+        in_background=genes.isin(background)
+        background_size=len(background)
+
+    membership=gene_sets.membership().astype(np.int32)
+    if background is not None:
+        membership.data=in_background[membership.indices].astype(np.int32)
+        membership.eliminate_zeros()
+    set_sizes=np.asarray(membership.sum(axis=1)).ravel()
+    tested=np.ones(len(set_sizes), dtype=bool)
+    if min_size is not None:
+        tested&=set_sizes>=min_size
+    if max_size is not None:
+        tested&=set_sizes<=max_size
+
+    #Queries as a queries by genes matrix, query genes outside of the background are dropped
+    query_names=list(queries)
+    query_genes=[pd.unique(np.asarray(list(queries[i]), dtype=object)) for i in query_names]
+    rows=np.repeat(np.arange(len(query_names)), [len(i) for i in query_genes])
+    query_genes=np.concatenate(query_genes) if query_genes else np.array([], dtype=object)
+    if background is None:
+        keep=genes.get_indexer(query_genes)>=0
+    else:
+        keep=background.get_indexer(query_genes)>=0
+    rows=rows[keep]
+    gene_ids=genes.get_indexer(query_genes[keep])
+    query_sizes=np.bincount(rows, minlength=len(query_names))
+
+    in_sets=gene_ids>=0
+    query_matrix=sparse.csr_matrix((np.ones(in_sets.sum(), dtype=np.int32), (rows[in_sets], gene_ids[in_sets])),
+                                   shape=(len(query_names), len(genes)))
+
+    #Sets by queries, so the large membership matrix is not transposed
+    overlaps=sparse.coo_matrix(membership@query_matrix.T.tocsr())
+    keep=(overlaps.data>=1)&tested[overlaps.row]
+    query_ids, set_ids, overlap=overlaps.col[keep], overlaps.row[keep], overlaps.data[keep]
+
+    p_values=_hypergeometric_sf(overlap, background_size, set_sizes[set_ids], query_sizes[query_ids])
+    results=pd.DataFrame({
+        'query': np.asarray(query_names, dtype=object)[query_ids],
+        'gene_set': gene_sets.set_names[set_ids],
+        'overlap': overlap.astype(np.int64),
+        'query_size': query_sizes[query_ids],
+        'set_size': set_sizes[set_ids],
+        'background_size': background_size,
+        'p_value': p_values})
+
+    order=np.lexsort((set_ids, p_values, query_ids))
+    results=results.iloc[order].reset_index(drop=True)
+    results['fdr']=_benjamini_hochberg(results['p_value'].to_numpy(), query_ids[order], int(tested.sum()))
+
+    #Pairs under min_overlap are dropped after the FDR correction
+    keep=results['overlap'].to_numpy()>=min_overlap
+    results=results.loc[keep].reset_index(drop=True)
+    order=order[keep]
+
+    if return_genes:
+        results['genes']=[list(gene_sets.genes[np.intersect1d(gene_ids[rows==q], gene_sets.members[
+                              gene_sets.set_indptr[i]:gene_sets.set_indptr[i+1]])])
+                          for q, i in zip(query_ids[order], set_ids[order])]
+    return results
+
+def _benjamini_hochberg(p_values, groups, n_tests):
+    '''
+    Internal function returning Benjamini-Hochberg adjusted p-values, with p_values sorted by
+    group then p-value and n_tests tests per group. Tests left out of p_values have larger
+    p-values than any in p_values
+    '''
+    if not len(p_values):
+        return p_values
+    starts=np.flatnonzero(np.r_[True, groups[1:]!=groups[:-1]])
+    ranks=np.arange(len(p_values))-np.repeat(starts, np.diff(np.r_[starts, len(p_values)]))+1
+    adjusted=p_values*n_tests/ranks
+
+    #Running minimum from the largest p-value of each group down
+    adjusted=pd.Series(adjusted[::-1]).groupby(groups[::-1]).cummin().to_numpy()[::-1]
+    return np.minimum(adjusted, 1)
+
+def _hypergeometric_sf(k, population, successes, draws):
+    '''
+    Internal function returning the probability of drawing at least k successes, for arrays
+    of k, successes and draws. The terms of every pair are summed at once, from the upper tail
+    when k is over the mean, otherwise from the lower tail (whichever has fewer terms), scaled
+    by the largest term to keep small p-values
+    '''
+    k=np.asarray(k, dtype=np.int64)
+    successes=np.asarray(successes, dtype=np.int64)
+    draws=np.asarray(draws, dtype=np.int64)
+    p_values=np.zeros(len(k))
+    if not len(k):
+        return p_values
+
+    #Log factorials of every count that can come up
+    log_factorial=gammaln(np.arange(population+2, dtype=float))
+
+    lowest=np.maximum(0, draws+successes-population)
+    highest=np.minimum(successes, draws)
+    upper_tail=k*population>draws*successes
+    first=np.where(upper_tail, k, lowest)
+    lengths=np.maximum(np.where(upper_tail, highest-k+1, k-lowest), 0)
+
+    has_terms=np.flatnonzero(lengths)
+    if len(has_terms):
+        starts=np.concatenate([[0], np.cumsum(lengths[has_terms])[:-1]])
+        pair=np.repeat(has_terms, lengths[has_terms])
+        i=first[pair]+np.arange(len(pair))-np.repeat(starts, lengths[has_terms])
+
+        K=successes[pair]
+        n=draws[pair]
+        log_terms=(log_factorial[K+1]-log_factorial[i+1]-log_factorial[K-i+1]
+                   +log_factorial[population-K+1]-log_factorial[n-i+1]-log_factorial[population-K-n+i+1]
+                   -log_factorial[population+1]+log_factorial[n+1]+log_factorial[population-n+1])
+
+        largest=np.maximum.reduceat(log_terms, starts)
+        p_values[has_terms]=np.exp(largest)*np.add.reduceat(
+                np.exp(log_terms-np.repeat(largest, lengths[has_terms])), starts)
+
+    #Lower tails hold the probability of fewer than k successes
+    p_values=np.where(upper_tail, p_values, 1-p_values)
+    return np.clip(p_values, 0, 1)
@@ -0,0 +1,36 @@
+'''
+Writing numpy .npz archives for the file handling functions and caches
+
+Author: Stephanie Ting
+Stephanie.Ting.3@gmail.com
+
+Last edited:
+10/17/2026
+'''
+
+import os
+import uuid
+import numpy as np
+
+def _savez(path, compressed=False, **arrays):
+    '''
+    Internal function writing arrays to an .npz file at exactly path
+
+    Writes through a file object so numpy does not append its own extension, to a temporary file
+    of its own next to path that is then moved into place, so readers never see a partial file and
+    processes writing the same path at once each replace it with a whole file
+
+    path - string - file path
+    compressed - if True uses np.savez_compressed
+    arrays - arrays to save, by name
+    '''
+    #Created exclusively with the usual permissions, unlike tempfile.mkstemp's owner only files
+    temp=path+'.'+uuid.uuid4().hex+'.tmp'
+    try:
+        with open(temp, 'xb') as f:
+            (np.savez_compressed if compressed else np.savez)(f, **arrays)
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
@@ -0,0 +1,159 @@
+'''
+Structured progress events for long running file handling functions
+
+Functions report through the reporter set with reporting(). Each event is a dict with
+    'event' - 'start' or 'end' of a stage, 'progress' within a stage (ex. after each chunk),
+              or 'message' for the progress messages that used to be printed
+    'stage' - name of the current stage (ex. 'read', 'counting'), or None outside of stages
+and, depending on the event,
+    'message' - string, for 'message' events
+    'seconds' - wall time of the stage, for 'end' events
+    'rows' - rows processed so far, for 'progress' events and 'end' events where known
+    'peak_rss' - peak resident memory of the process so far in bytes, for 'end' events,
+                 None where the platform doesn't report it
+plus any stage specific fields (ex. 'features_kept' and 'features_dropped') and the fields
+given to reporting() (ex. the input file).
+
+Author: Stephanie Ting
+Stephanie.Ting.3@gmail.com
+
+Last edited:
+10/17/2026
+'''
+
+import sys
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource=None
+
+_REPORTER=contextvars.ContextVar('progress_reporter', default=None)
+
+class ProgressReporter:
+    '''
+    Sends progress events to a callback
+
+    progress - one of
+        'print' - prints the progress messages, as the functions always did
+        'log' - sends messages and stage timings to the logger named logger_name. Stage events
+                are logged at INFO with the event dict as the 'progress_event' attribute of the
+                log record, 'progress' events at DEBUG
+        logging.Logger - same as 'log' with that logger
+        None or 'silent' - reports nothing
+        function - called with every event dict
+    '''
+
+    def __init__(self, progress='print', logger_name=__name__, **fields):
+        if progress=='print':
+            self.callback=_print_event
+        elif progress=='log':
+            self.callback=_log_event(logging.getLogger(logger_name))
+        elif isinstance(progress, logging.Logger):
+            self.callback=_log_event(progress)
+        elif progress is None or progress=='silent':
+            self.callback=None
+        elif callable(progress):
+            self.callback=progress
+        else:
+            raise AssertionError(
+                    "progress must be \"print\", \"log\", \"silent\", None, a logging.Logger or a function"
+                    )
+        self.fields=fields
+        self.current=None
+
+    def emit(self, event, **fields):
+        if self.callback is not None:
+            self.callback(dict(self.fields, event=event, stage=self.current, **fields))
+
+    def message(self, message):
+        self.emit('message', message=message)
+
+    def progress(self, **fields):
+        self.emit('progress', **fields)
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Times the stage of the with block. Fields added to the yielded dict are sent with the
+        'end' event
+        '''
+        outer=self.current
+        self.current=name
+        self.emit('start')
+        fields={}
+        start=time.perf_counter()
+        try:
+            yield fields
+            self.emit('end', seconds=time.perf_counter()-start, peak_rss=peak_rss(), **fields)
+        finally:
+            self.current=outer
+
+@contextmanager
+def reporting(progress='print', logger_name=__name__, **fields):
+    '''
+    Sets the reporter used by message() and stage() in the with block
+
+    progress - see ProgressReporter
+    fields - added to every event (ex. input_file)
+    '''
+    token=_REPORTER.set(ProgressReporter(progress, logger_name, **fields))
+    try:
+        yield _REPORTER.get()
+    finally:
+        _REPORTER.reset(token)
+
+def reporter():
+    '''
+    Returns the current ProgressReporter. Outside of reporting() messages are printed
+    '''
+    current=_REPORTER.get()
+    if current is None:
+        current=ProgressReporter('print')
+        _REPORTER.set(current)
+    return current
+
+def message(message):
+    '''
+    Reports a progress message
+    '''
+    reporter().message(message)
+
+def stage(name):
+    '''
+    Returns context manager timing a stage, see ProgressReporter.stage
+    '''
+    return reporter().stage(name)
+
+def peak_rss():
+    '''
+    Returns peak resident memory of the process in bytes, or None if it is not available
+    '''
+    if resource is None:
+        return None
+    peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linux reports kilobytes, macOS bytes
+    return peak if sys.platform=='darwin' else peak*1024
+
+def _print_event(event):
+    if event['event']=='message':
+        print(event['message'])
+
+def _log_event(logger):
+    def log_event(event):
+        if event['event']=='message':
+            logger.info(event['message'])
+        elif event['event']=='progress':
+            logger.debug("%s: %s", event['stage'], _event_fields(event), extra={'progress_event': event})
+        elif event['event']=='end':
+            logger.info("%s finished in %.2f s (%s)", event['stage'], event['seconds'], _event_fields(event),
+                        extra={'progress_event': event})
+    return log_event
+
+def _event_fields(event):
+    return ", ".join(str(key)+"="+str(value) for key, value in event.items()
+                     if not key in ['event', 'stage', 'seconds'])
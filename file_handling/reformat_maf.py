@@ -6,12 +6,29 @@ Stephanie.Ting.3@gmail.com
 Written sometime in 2018
 
 Last edited:
-4/29/2024
+10/17/2026
 '''
 
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 from copy import deepcopy
+from scipy import sparse
+from .gene_key import GeneKey
+from .npz import _savez
+from .progress import reporting, reporter, message, stage
+
+#Order of the features created for each row of the maf. Protein changes, Nonsilent and
+#MUT_All share one item space with the variant classifications (see _feature_names)
+_MUTATION_SLOTS=('protein_change', 'Nonsilent', 'variant_class')
+_SELECT_SLOTS=('protein_change', 'Nonsilent', 'variant_class', 'MUT_All')
+_COPY_NUMBER_SLOTS=('variant_class',)
+_SLOT_COUNT=4
+
+_TABLE_FORMATS=['sparse_binary_matrix', 'sparse binary matrix']
+_OUTPUT_FORMATS=_TABLE_FORMATS+['list of samples', 'npz', 'mtx']
 
 def produce_variant_file(
     maf_input_file,
@@ -29,7 +46,13 @@ def produce_variant_file(
     genes_with_all_entries=[],
     only_select_from_list=False,
     skiprows=1,
-    output_format='sparse_binary_matrix'):
+    output_format='sparse_binary_matrix',
+    engine='vectorized',
+    chunksize=None,
+    cache_dir=None,
+    counts_file=None,
+    previous_counts_file=None,
+    progress='print'):
 
     """
     Takes a file in maf or tsv format and outputs a sparse binary matrix or a list of samples
@@ -41,7 +64,14 @@ def produce_variant_file(
 
         tsv_output_file - string - file path and name of desired output file
 
-        key_file - string - path and file name of file to map genes to gene names
+        is_copy_number - boolean - if true mutation_classification_identifier holds copy number events
+            (ex. Amplification) and the output has one feature per gene and event. Uses the genes in
+            genes_with_all_entries, or every gene with events over change_thres if the list is
+            empty. For wide gene by sample tables (ex. GISTIC) use produce_copy_number_file
+
+        key_file - string or GeneKey - path and file name of file to map genes to gene names, a
+            GeneKey saved with GeneKey.save (.npz) or a GeneKey. Identifiers mapping to several
+            gene names are left out and reported (see file_handling.gene_key)
 
         gene_identifier_format - string - identifier type for genes. Must be one of the following:
             
@@ -80,20 +110,519 @@ def produce_variant_file(
 
         skiprows - int - number of rows between the top of the maf file and the header
 
-        output_format (TODO) - string - chooses whether to output a sparse binary matrix or a list of
-            samples for each variant. Sparse binary matrix is much less storage efficient
+        output_format - string - format of the output file. Must be one of the following:
+
+            - 'sparse_binary_matrix' (default) - tab separated 0/1 table with features as rows and
+              samples as columns. Much less storage efficient than the other formats
+            - 'list of samples' - one line per feature, the feature name followed by the samples
+              that have it, tab separated
+            - 'npz' - compressed numpy archive of the scipy.sparse CSR matrix and its labels
+            - 'mtx' - Matrix Market file, with the feature and sample names written one per line
+              to tsv_output_file+'.features.txt' and tsv_output_file+'.samples.txt'
+
+            All formats can be read back with read_variant_matrix
+
+        engine - string - 'vectorized' (default) builds the table from factorized columns in a single
+            pass. 'legacy' is the original row by row implementation, kept to check equivalence.
+            Both write identical files. Sample column order follows Python set order as it always
+            has, so set PYTHONHASHSEED when comparing files written by different processes.
+
+        chunksize - int - number of rows read at a time. If given, only the four needed columns
+            are read, in chunks, over two passes of the file (counting, then filling the table)
+            so memory stays proportional to the output instead of the input file. Requires the
+            vectorized engine.
+
+        cache_dir - string - directory in which to cache the parsed input. The four needed columns
+            are stored as categorical codes, after removing genes missing from key_file, so runs on
+            an unchanged file skip reading the maf and the key_file filtering step. Entries are
+            keyed on the path, size and modification time of maf_input_file and key_file and on the
+            selected columns. Entries are never removed: an entry whose files change is left in
+            cache_dir, so remove old entries by hand. Runs on the same file can share cache_dir at
+            the same time. Requires the vectorized engine.
+
+        counts_file - string - path of a sidecar file (.npz) in which to save the variant counts and
+            every candidate feature, including those under the thresholds, so new samples can be
+            appended later with previous_counts_file. Requires the vectorized engine.
+
+        previous_counts_file - string - counts_file written by an earlier run. maf_input_file then
+            only holds the new rows (ex. a new sequencing batch) and the output covers the earlier
+            and the new rows, exactly as if they had been run together. Features that now pass
+            variant_thres/change_thres are added, and thresholds and genes_with_all_entries may
+            change between runs. The other settings must match the earlier run. Only the new rows
+            are read, so the cost follows the new batch and the size of the output. Set
+            counts_file (it can be the same path) to keep appending.
+
+        progress - where progress is reported, one of
+            'print' - prints progress messages
+            'log' - logs messages and the timings of each stage with the logger of this module
+            logging.Logger - same as 'log' with that logger
+            None or 'silent' - reports nothing
+            function - called with a dict for every event, see file_handling.progress
+            Stages are 'key mapping', 'read', 'counting', 'thresholding', 'matrix build' and
+            'write'. Their 'end' events have the wall time, rows processed and peak memory, and
+            thresholding also has the features kept and dropped. When reading in chunks the
+            file is read during counting and matrix build, which then report rows per chunk.
+
+    Returns:
+        pandas DataFrame for 'sparse_binary_matrix', dict of features to lists of samples for
+        'list of samples', otherwise a tuple of scipy.sparse CSR matrix (features by samples),
+        numpy array of feature names and numpy array of sample names
     """
     
-    print("Reading file...")
-    d=pd.read_csv(maf_input_file, sep='\t', header=0, skiprows=skiprows, index_col=None, dtype=str)
-    ds=d.loc[:,[gene_identifier, sample_identifier,mutation_classification_identifier, protein_change_identifier]]
+    if not engine in ['vectorized', 'legacy']:
+        raise AssertionError(
+                "engine must be \"vectorized\" or \"legacy\""
+                )
+
+    if not output_format in _OUTPUT_FORMATS:
+        raise AssertionError(
+                "output_format must be one of "+", ".join(_OUTPUT_FORMATS)
+                )
+
+    vectorized_only=[chunksize, cache_dir, counts_file, previous_counts_file]
+    if engine == 'legacy' and any(i is not None for i in vectorized_only):
+        raise AssertionError(
+                "chunksize, cache_dir, counts_file and previous_counts_file require engine \"vectorized\""
+                )
+
+    if engine == 'legacy' and is_copy_number and not only_select_from_list and not genes_with_all_entries:
+        raise AssertionError(
+                "is_copy_number without genes_with_all_entries requires engine \"vectorized\""
+                )
+
+    columns=(gene_identifier, sample_identifier, mutation_classification_identifier, protein_change_identifier)
+
+    with reporting(progress, __name__, function='produce_variant_file', input_file=maf_input_file):
+        key_df=_read_key_stage(key_file, gene_identifier_format)
+
+        if engine == 'legacy':
+            with stage('read') as fields:
+                message("Reading file...")
+                d=pd.read_csv(maf_input_file, sep='\t', header=0, skiprows=skiprows, index_col=None, dtype=str)
+                ds=d.loc[:,[gene_identifier, sample_identifier,mutation_classification_identifier, protein_change_identifier]]
+                fields['rows']=len(ds)
+
+            #The legacy branches only fill the table for their own spelling of the format, and the
+            #copy number branch never matched the default. Both accept 'list of samples'
+            with stage('matrix build') as fields:
+                pre_table=_legacy_table(ds, key_df, columns, is_copy_number, variant_thres, change_thres,
+                                        genes_with_all_entries, only_select_from_list, 'list of samples')
+
+                matrix=sparse.csr_matrix(pre_table.to_numpy(dtype=np.int8))
+                features=np.asarray(pre_table.index, dtype=object)
+                samples=np.asarray(pre_table.columns, dtype=object)
+                fields.update(rows=len(ds), features=len(features), samples=len(samples))
+        else:
+            with stage('read') as fields:
+                read_chunks=_chunk_reader(maf_input_file, key_df, columns, skiprows, chunksize, cache_dir,
+                                          key_file, gene_identifier_format)
+            if counts_file is None and previous_counts_file is None:
+                matrix, features, samples=_vectorized_table(read_chunks, key_df, columns, is_copy_number, variant_thres,
+                                                            change_thres, genes_with_all_entries, only_select_from_list)
+            else:
+                matrix, features, samples=_incremental_table(read_chunks, key_df, columns, is_copy_number, variant_thres,
+                                                             change_thres, genes_with_all_entries, only_select_from_list,
+                                                             counts_file, previous_counts_file, gene_identifier_format)
+
+        return _write_stage(matrix, features, samples, tsv_output_file, output_format,
+                            underscore_and_truncate_sample_names)
+
+def produce_merged_variant_file(
+    maf_input_files,
+    tsv_output_file,
+    key_file=None,
+    is_copy_number=False,
+    gene_identifier_format=None,
+    gene_identifier='Hugo_Symbol',
+    mutation_classification_identifier='Variant_Classification',
+    sample_identifier='Tumor_Sample_Barcode',
+    protein_change_identifier='Protein_Change',
+    underscore_and_truncate_sample_names=False,
+    variant_thres=80,
+    change_thres=80,
+    genes_with_all_entries=[],
+    only_select_from_list=False,
+    skiprows=1,
+    output_format='sparse_binary_matrix',
+    chunksize=None,
+    cache_dir=None,
+    n_workers=None,
+    progress='print'):
+
+    """
+    Takes several files in maf or tsv format (ex. one per cohort or sequencing batch) and outputs
+    one sparse binary matrix over all of their samples. Files are counted in parallel and the
+    counts are combined before applying variant_thres and change_thres, so the thresholds apply
+    to all files together.
+
+    The output is the same as produce_variant_file on the files concatenated in the given order,
+    whatever the number of workers.
+
+    Parameters:
+
+        maf_input_files - list of strings - file paths to the input files. All files must share
+            the column names and skiprows
+
+        n_workers - int - number of worker processes. Defaults to the number of processors,
+            1 runs every file in this process
+
+        Every file is read twice, once to count and once to fill the table, unless cache_dir
+        is given. All other parameters are described in produce_variant_file.
+
+    Returns:
+        same as produce_variant_file
+    """
+
+    if not output_format in _OUTPUT_FORMATS:
+        raise AssertionError(
+                "output_format must be one of "+", ".join(_OUTPUT_FORMATS)
+                )
+
+    with reporting(progress, __name__, function='produce_merged_variant_file', input_file=list(maf_input_files)):
+        return _merged_table(maf_input_files, tsv_output_file, key_file, is_copy_number, gene_identifier_format,
+                             (gene_identifier, sample_identifier, mutation_classification_identifier,
+                              protein_change_identifier),
+                             underscore_and_truncate_sample_names, variant_thres, change_thres,
+                             genes_with_all_entries, only_select_from_list, skiprows, output_format, chunksize,
+                             cache_dir, n_workers)
+
+def _merged_table(maf_input_files, tsv_output_file, key_file, is_copy_number, gene_identifier_format, columns,
+                  underscore_and_truncate_sample_names, variant_thres, change_thres, genes_with_all_entries,
+                  only_select_from_list, skiprows, output_format, chunksize, cache_dir, n_workers):
+    '''
+    Internal function that runs produce_merged_variant_file
+    '''
+    key_df=_read_key_stage(key_file, gene_identifier_format)
+    readers=[(maf_input_file, key_df, columns, skiprows, chunksize, cache_dir, key_file, gene_identifier_format)
+             for maf_input_file in maf_input_files]
+
+    if n_workers==1:
+        executor=None
+        map_files=map
+    else:
+        executor=ProcessPoolExecutor(max_workers=n_workers)
+        map_files=executor.map
+
+    try:
+        with stage('counting') as fields:
+            message("Counting "+str(len(readers))+" files...")
+            file_counts=list(map_files(_count_file, readers))
+
+            counts=_count_variants(pd.DataFrame(columns=list(columns), dtype=object), columns)
+            row_offsets=[]
+            for i in file_counts:
+                row_offsets.append(counts['rows'])
+                counts=_merge_counts(counts, i)
+            fields.update(rows=counts['rows'], files=len(readers))
+
+        sample_index=pd.Index(_sample_order(counts['samples']))
+        plan=_threshold_stage(counts, key_df, is_copy_number, variant_thres, change_thres,
+                              genes_with_all_entries, only_select_from_list)
+
+        with stage('matrix build') as fields:
+            message("Creating final table...")
+            entries=list(map_files(_file_entries, [(reader, plan, sample_index, row_offset, counts['rows'])
+                                                   for reader, row_offset in zip(readers, row_offsets)]))
+            matrix, features, samples=_sparse_table(entries, plan, sample_index)
+            fields.update(rows=counts['rows'], features=len(features), samples=len(samples))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return _write_stage(matrix, features, samples, tsv_output_file, output_format,
+                        underscore_and_truncate_sample_names)
+
+def produce_copy_number_file(
+    cn_input_file,
+    tsv_output_file,
+    key_file=None,
+    gene_identifier_format=None,
+    gene_identifier='Gene Symbol',
+    non_sample_columns=['Locus ID', 'Cytoband'],
+    copy_number_events={-2: 'HOMDEL', -1: 'HETLOSS', 1: 'GAIN', 2: 'AMP'},
+    underscore_and_truncate_sample_names=False,
+    change_thres=80,
+    genes_with_all_entries=[],
+    skiprows=0,
+    output_format='sparse_binary_matrix',
+    chunksize=None,
+    progress='print'):
+
+    """
+    Takes a wide table of discrete copy number calls with one row per gene and one column per
+    sample (ex. GISTIC all_thresholded.by_genes.txt) and outputs a sparse binary matrix with one
+    feature per gene and copy number event (ex. TP53_HOMDEL). The features and values are the
+    same as produce_variant_file with is_copy_number on the calls in long format. Samples are in
+    the order of the columns of the file header, while produce_variant_file orders them by
+    Python set order, so the columns of the two outputs can be in a different order.
+
+    Parameters:
+
+        cn_input_file - string - file path to the tab separated copy number table
+
+        gene_identifier - string - name of the column with the gene identifiers
+
+        non_sample_columns - list of strings - columns that are neither gene_identifier nor a sample
+
+        copy_number_events - dict - copy number calls to keep as keys and the names of their events
+            as values. Other calls (ex. 0) are ignored
+
+        change_thres - int - minimum number of samples with an event for a gene to keep the event
+
+        genes_with_all_entries - list of string gene names - if given only these genes are
+            kept, with all of their events. Otherwise every gene is kept
+
+        chunksize - int - if given the table is read chunksize rows (genes) at a time and read
+            twice, once to count events and once to fill the table
+
+        All other parameters are described in produce_variant_file.
+
+    Returns:
+        same as produce_variant_file
+    """
+
+    if not output_format in _OUTPUT_FORMATS:
+        raise AssertionError(
+                "output_format must be one of "+", ".join(_OUTPUT_FORMATS)
+                )
+
+    header=pd.read_csv(cn_input_file, sep='\t', skiprows=skiprows, nrows=0).columns
+    if not gene_identifier in header:
+        raise AssertionError(
+                "gene_identifier \""+gene_identifier+"\" is not a column of cn_input_file"
+                )
+    samples=[i for i in header if i!=gene_identifier and not i in non_sample_columns]
+
+    columns=(gene_identifier, 'Sample', 'Copy_Number_Event', 'Protein_Change')
+
+    def read_table():
+        return pd.read_csv(cn_input_file, sep='\t', skiprows=skiprows, index_col=None,
+                           usecols=[gene_identifier]+samples, dtype={gene_identifier: str},
+                           chunksize=chunksize)
+
+    with reporting(progress, __name__, function='produce_copy_number_file', input_file=cn_input_file):
+        key_df=_read_key_stage(key_file, gene_identifier_format)
+
+        with stage('read') as fields:
+            if chunksize is None:
+                message("Reading file...")
+                ds=_known_genes(_long_copy_number(read_table(), samples, copy_number_events, columns), key_df, columns)
+                read_chunks=lambda: [ds]
+                fields['rows']=len(ds)
+            else:
+                message("Reading file in chunks of "+str(chunksize)+" rows...")
+                read_chunks=lambda: (_known_genes(_long_copy_number(i, samples, copy_number_events, columns), key_df, columns)
+                                     for i in read_table())
+
+        matrix, features, samples=_vectorized_table(read_chunks, key_df, columns, True, 0, change_thres,
+                                                    genes_with_all_entries, False, samples)
+
+        return _write_stage(matrix, features, samples, tsv_output_file, output_format,
+                            underscore_and_truncate_sample_names)
+
+def read_variant_matrix(input_file, output_format='sparse_binary_matrix'):
+    '''
+    Reads a file written by produce_variant_file
+
+    input_file - string - path to the file (tsv_output_file of produce_variant_file)
+    output_format - string - output_format the file was written with. For 'list of samples'
+                    only samples with at least one feature can be recovered
+
+    Returns tuple of scipy.sparse CSR matrix (features by samples), numpy array of feature
+    names and numpy array of sample names
+    '''
+
+    if output_format in _TABLE_FORMATS:
+        table=pd.read_csv(input_file, sep='\t', index_col=0, dtype={0: str})
+        return (sparse.csr_matrix(table.to_numpy(dtype=np.int8)),
+                np.asarray(table.index, dtype=object),
+                np.asarray(table.columns, dtype=object))
+
+    elif output_format == 'list of samples':
+        features=[]
+        members=[]
+        with open(input_file) as f:
+            for line in f:
+                fields=line.rstrip('\n').split('\t')
+                features.append(fields[0])
+                members.append(fields[1:])
+        sample_codes, samples=pd.factorize(pd.Series([i for j in members for i in j], dtype=object))
+        rows=np.repeat(np.arange(len(features)), [len(i) for i in members])
+        matrix=sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, sample_codes)),
+                                 shape=(len(features), len(samples)))
+        return matrix, np.asarray(features, dtype=object), np.asarray(samples, dtype=object)
+
+    elif output_format == 'npz':
+        with np.load(input_file) as archive:
+            matrix=sparse.csr_matrix((archive['data'], archive['indices'], archive['indptr']),
+                                     shape=tuple(archive['shape']))
+            return matrix, archive['features'].astype(object), archive['samples'].astype(object)
+
+    elif output_format == 'mtx':
+        from scipy.io import mmread
+        labels=[]
+        for suffix in ['.features.txt', '.samples.txt']:
+            with open(input_file+suffix) as f:
+                labels.append(np.asarray([line.rstrip('\n') for line in f], dtype=object))
+        return sparse.csr_matrix(mmread(input_file), dtype=np.int8), labels[0], labels[1]
+
+    else:
+        raise AssertionError(
+                "output_format must be one of "+", ".join(_OUTPUT_FORMATS)
+                )
+
+def _read_key_file(key_file, gene_identifier_format):
+    '''
+    Internal function that reads the key file into a pandas Series of gene names indexed by
+    gene_identifier_format, or returns None if there is no key file
+
+    key_file - string path to a key file or to a saved GeneKey (.npz), or GeneKey
+    '''
+    if key_file is None or isinstance(key_file, str) and not key_file:
+        return None
+
+    if not isinstance(key_file, GeneKey):
+        if str(key_file).endswith('.npz'):
+            key_file=GeneKey.load(key_file)
+        else:
+            key_file=GeneKey.from_key_file(key_file, [gene_identifier_format])
+    return key_file.series(gene_identifier_format)
+
+def _read_key_stage(key_file, gene_identifier_format):
+    '''
+    Internal function that reads the key file as the 'key mapping' stage
+    '''
+    with stage('key mapping') as fields:
+        key_df=_read_key_file(key_file, gene_identifier_format)
+        fields['identifiers']=0 if key_df is None else len(key_df)
+    return key_df
+
+def _threshold_stage(counts, key_df, is_copy_number, variant_thres, change_thres,
+                     genes_with_all_entries, only_select_from_list):
+    '''
+    Internal function that runs _feature_plan as the 'thresholding' stage and reports the
+    features it keeps and drops
+    '''
+    with stage('thresholding') as fields:
+        plan=_feature_plan(counts, key_df, is_copy_number, variant_thres, change_thres,
+                           genes_with_all_entries, only_select_from_list)
+        fields.update(_threshold_summary(counts, plan))
+    return plan
+
+def _threshold_summary(counts, plan):
+    '''
+    Internal function that counts the gene features found in the input that plan keeps and
+    drops. Features are counted per gene before merging features that share a name
+
+    Returns dict with 'features_kept' and 'features_dropped', and the same per kind of feature
+    (ex. 'variant_class_kept')
+    '''
+    class_counts=counts['class_counts'].reindex(plan['genes'], fill_value=0)
+    classes=plan['classes']
+    found_class=class_counts.to_numpy()>0
+    found_class[:, np.asarray(classes.isna())]=False
+
+    variants=counts['variants'].dropna(subset=['protein_change'])
+    variant_genes=_lookup(plan['genes'], variants['gene'])
+    variant_genes=variant_genes[variant_genes>=0]
+
+    nonsilent=np.asarray((classes!='Silent')&~classes.isna())
+    found_gene=found_class.any(axis=1)
+    found={
+        'protein_change': (len(variant_genes), int(plan['keep_variant'][variant_genes].sum())),
+        'Nonsilent': (int(found_class[:, nonsilent].any(axis=1).sum()),
+                      int((found_class[:, nonsilent].any(axis=1)&plan['keep_nonsilent']).sum())),
+        'variant_class': (int(found_class.sum()), int((found_class&plan['keep_class']).sum())),
+        'MUT_All': (int(found_gene.sum()), int(found_gene.sum()))}
+
+    summary={'features_kept': 0, 'features_dropped': 0}
+    for slot in plan['slots']:
+        total, kept=found[slot]
+        summary[slot+'_kept']=kept
+        summary[slot+'_dropped']=total-kept
+        summary['features_kept']+=kept
+        summary['features_dropped']+=total-kept
+    return summary
+
+def _write_stage(matrix, features, samples, output_file, output_format, underscore_and_truncate_sample_names):
+    '''
+    Internal function that edits the sample names and writes the output as the 'write' stage
+    '''
+    with stage('write') as fields:
+        if underscore_and_truncate_sample_names:
+            samples=_truncate_sample_names(samples)
+
+        message("Writing to "+ output_file)
+        fields.update(features=len(features), samples=len(samples), entries=int(matrix.nnz))
+        return _write_variant_matrix(matrix, features, samples, output_file, output_format)
+
+def _truncate_sample_names(samples):
+    '''
+    Internal function that changes TCGA sample names to the format TCGA_XX_XXXX
+    '''
+    message("Editing sample names...")
+    column_list=[]
+    for i in samples:
+        column_list.append('_'.join(i.split(sep='-')[:3]))
+    return np.asarray(column_list, dtype=object)
+
+def _write_variant_matrix(matrix, features, samples, output_file, output_format):
+    '''
+    Internal function that writes the output of produce_variant_file
+
+    matrix - scipy.sparse CSR matrix with features as rows and samples as columns
+    features - numpy array of feature names
+    samples - numpy array of sample names
+
+    Returns the object described in produce_variant_file
+    '''
+
+    if output_format in _TABLE_FORMATS:
+        pre_table=pd.DataFrame(matrix.astype(np.int64).toarray(), index=pd.Index(features, dtype=object),
+                               columns=pd.Index(samples, dtype=object))
+        pre_table.to_csv(output_file, sep='\t')
+        return pre_table
+
+    elif output_format == 'list of samples':
+        sample_lists={}
+        with open(output_file, 'w') as f:
+            for i, feature in enumerate(features):
+                sample_lists[feature]=list(samples[matrix.indices[matrix.indptr[i]:matrix.indptr[i+1]]])
+                f.write('\t'.join([str(feature)]+[str(j) for j in sample_lists[feature]])+'\n')
+        return sample_lists
+
+    elif output_format == 'npz':
+        _savez(output_file, compressed=True, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+               shape=np.asarray(matrix.shape), features=np.asarray(features, dtype=str),
+               samples=np.asarray(samples, dtype=str))
+
+    elif output_format == 'mtx':
+        from scipy.io import mmwrite
+        with open(output_file, 'wb') as f:
+            mmwrite(f, matrix, field='integer')
+        for suffix, labels in [('.features.txt', features), ('.samples.txt', samples)]:
+            with open(output_file+suffix, 'w') as f:
+                f.write(''.join(str(i)+'\n' for i in labels))
+
+    return matrix, features, samples
+
+def _legacy_table(ds, key_df, columns, is_copy_number, variant_thres, change_thres,
+                  genes_with_all_entries, only_select_from_list, output_format):
+    '''
+    Internal function with the original row by row implementation of produce_variant_file
+
+    ds - pandas DataFrame with the gene, sample, variant classification and protein change columns
+    key_df - pandas Series mapping gene identifiers to gene names or None
+    columns - tuple of the gene, sample, variant classification and protein change column names
+
+    Returns pandas DataFrame with features as rows and samples as columns
+    '''
+
+    gene_identifier, sample_identifier, mutation_classification_identifier, protein_change_identifier=columns
+    key_file=key_df is not None
 
     if key_file:
 
-        key_df=pd.read_csv(key_file, sep='\t')
-        key_df.set_index(gene_identifier_format, inplace=True)
-        key_df=key_df['Gene name']
-        key_df=key_df.drop_duplicates()
         count=set()
 
         #Remove gene identifier rows that don't have a corresponding gene name
@@ -109,7 +638,7 @@ def produce_variant_file(
     sample_dict=dict(zip(list(sample_set), range(0, len(sample_set))))
 
     if only_select_from_list:
-        print("Selecting from list of genes...")
+        message("Selecting from list of genes...")
         final_dict={}
         for gene in genes_with_all_entries:
             gene_ds=ds.loc[ds[gene_identifier]==gene]
@@ -161,7 +690,7 @@ def produce_variant_file(
 
     elif is_copy_number:
 
-        print("Creating index...")
+        message("Creating index...")
         final_dict={}
         for gene in genes_with_all_entries:
             gene_ds=ds.loc[ds[gene_identifier]==gene]
@@ -185,7 +714,7 @@ def produce_variant_file(
              
     else:
 
-        print("Counting each type of variant...")
+        message("Counting each type of variant...")
         #Keep track of how many variants per gene
         gene_variant_count={}
 
@@ -233,7 +762,7 @@ def produce_variant_file(
         
         _gene_variant_count=deepcopy(gene_variant_count)
         
-        print("Dropping variants under threshold...")
+        message("Dropping variants under threshold...")
         for gene in _gene_variant_count:
             if key_file:
                 final_gene=key_df.loc[gene]
@@ -256,7 +785,7 @@ def produce_variant_file(
 
         final_dict={}
 
-        print("Creating final table...")
+        message("Creating final table...")
 
         #Go through table line by line
         
@@ -291,17 +820,795 @@ def produce_variant_file(
                     final_dict[final_gene+'_'+variant_class][sample_key]=1            
                 
 
-    print("Creating DataFrame")
+    message("Creating DataFrame")
 
-    pre_table=pd.DataFrame(final_dict, index=sample_dict.keys()).T
-    
-    if underscore_and_truncate_sample_names:
-        print("Editing sample names...")
-        column_list=[]
-        for i in pre_table.columns:
-            column_list.append('_'.join(i.split(sep='-')[:3]))
-        pre_table.columns=column_list
-        
-    print ("Writing to "+ tsv_output_file)
-    pre_table.to_csv(tsv_output_file, sep='\t')
-    return pre_table
+    return pd.DataFrame(final_dict, index=sample_dict.keys()).T
+
+def _read_maf(maf_input_file, columns, skiprows, chunksize=None):
+    '''
+    Internal function that reads only the needed columns of a maf file as strings
+
+    columns - tuple of the gene, sample, variant classification and protein change column names
+    chunksize - int - if given returns an iterator of pandas DataFrames of chunksize rows
+
+    Returns pandas DataFrame or iterator of pandas DataFrames
+    '''
+    if chunksize is not None:
+        message("Reading file in chunks of "+str(chunksize)+" rows...")
+    return pd.read_csv(maf_input_file, sep='\t', header=0, skiprows=skiprows, index_col=None,
+                       usecols=list(columns), dtype=str, chunksize=chunksize)
+
+def _vectorized_table(read_chunks, key_df, columns, is_copy_number, variant_thres, change_thres,
+                      genes_with_all_entries, only_select_from_list, samples=None):
+    '''
+    Internal function that builds the same table as _legacy_table from factorized columns.
+    Each row is visited once instead of once per gene.
+
+    read_chunks - function returning an iterable of pandas DataFrames with the gene, sample,
+                  variant classification and protein change columns, without genes missing from
+                  key_df. It is called twice, once to count variants and once to fill the table
+    key_df - pandas Series mapping gene identifiers to gene names or None
+    columns - tuple of the gene, sample, variant classification and protein change column names
+    samples - list of samples in output order, defaults to the samples in read_chunks
+
+    Returns scipy.sparse CSR matrix with features as rows and samples as columns, numpy array
+    of feature names and numpy array of sample names
+    '''
+
+    with stage('counting') as fields:
+        counts=_count_chunks(read_chunks, columns)
+        fields['rows']=counts['rows']
+    if samples is None:
+        sample_index=pd.Index(_sample_order(counts['samples']))
+    else:
+        sample_index=pd.Index(samples, dtype=object)
+
+    plan=_threshold_stage(counts, key_df, is_copy_number, variant_thres, change_thres,
+                          genes_with_all_entries, only_select_from_list)
+
+    with stage('matrix build') as fields:
+        message("Creating final table...")
+        entries=_chunk_entries(read_chunks, plan, sample_index, columns, 0, counts['rows'])
+        matrix, features, samples=_sparse_table([entries], plan, sample_index)
+        fields.update(rows=counts['rows'], features=len(features), samples=len(samples))
+    return matrix, features, samples
+
+def _incremental_table(read_chunks, key_df, columns, is_copy_number, variant_thres, change_thres,
+                       genes_with_all_entries, only_select_from_list, counts_file, previous_counts_file,
+                       gene_identifier_format):
+    '''
+    Internal function that builds the table of _vectorized_table from the candidate features
+    of this file and of an earlier run, and saves them for the next run
+
+    counts_file - string - path to write the sidecar to, or None
+    previous_counts_file - string - sidecar written by an earlier run, or None
+
+    Returns same as _vectorized_table
+    '''
+
+    with stage('counting') as fields:
+        counts=_count_chunks(read_chunks, columns)
+        row_offset=0
+        if previous_counts_file is not None:
+            message("Reading counts from "+previous_counts_file)
+            previous=_read_sidecar(previous_counts_file)
+            row_offset=previous['counts']['rows']
+            counts=_merge_counts(previous['counts'], counts)
+        fields.update(rows=counts['rows']-row_offset, previous_rows=row_offset)
+
+    sample_index=pd.Index(_sample_order(counts['samples']))
+    plan=_threshold_stage(counts, key_df, is_copy_number, variant_thres, change_thres,
+                          genes_with_all_entries, only_select_from_list)
+
+    #Thresholds can change between runs, other settings decide what the counts and candidates are
+    settings=repr((list(columns), bool(is_copy_number), bool(only_select_from_list), plan['slots'],
+                   list(dict.fromkeys(genes_with_all_entries or [])) if only_select_from_list or is_copy_number else None,
+                   gene_identifier_format, _key_digest(key_df)))
+    if previous_counts_file is not None and previous['settings'] != settings:
+        raise AssertionError(
+                "previous_counts_file was written with different columns, key_file or gene selection"
+                )
+
+    with stage('matrix build') as fields:
+        message("Collecting candidate features...")
+        candidate_plan=_candidate_plan(plan)
+        entries=_chunk_entries(read_chunks, candidate_plan, sample_index, columns, row_offset, counts['rows'])
+        candidates=_candidates(entries, candidate_plan, sample_index, counts)
+        if previous_counts_file is not None:
+            candidates=_merge_candidates(previous['candidates'], candidates)
+
+        if counts_file is not None:
+            message("Writing counts to "+counts_file)
+            _write_sidecar(counts_file, counts, candidates, settings)
+
+        message("Creating final table...")
+        entries=_candidate_entries(candidates, plan, sample_index, counts)
+        matrix, features, samples=_sparse_table([entries], plan, sample_index)
+        fields.update(rows=counts['rows']-row_offset, features=len(features), samples=len(samples))
+    return matrix, features, samples
+
+def _candidate_plan(plan):
+    '''
+    Internal function returning plan with every feature kept, whatever the thresholds
+    '''
+    return dict(plan,
+                keep_variant=np.ones(len(plan['genes']), dtype=bool),
+                keep_nonsilent=np.ones(len(plan['genes']), dtype=bool),
+                keep_class=np.broadcast_to(np.asarray(plan['classes'].notna()), plan['keep_class'].shape))
+
+def _candidates(entries, plan, sample_index, counts):
+    '''
+    Internal function that describes features by labels so they stay valid when counts are
+    merged with counts of new rows
+
+    entries - numpy arrays returned by _chunk_entries with a plan from _candidate_plan
+    counts - dict returned by _count_variants for every row
+
+    Returns dict with
+        'features' - pandas DataFrame with, per feature, the position of its gene in the counts
+                     ('gene'), its slot (see _SLOT_COUNT), the protein change or variant
+                     classification or slot name ('item') and the first row setting it ('first_row')
+        'entries' - tuple of numpy arrays of the feature and the position of the sample in
+                    counts['samples'] of each entry
+    '''
+    seq, features, samples=entries
+    codes, uniques=pd.factorize(features)
+    first=np.full(len(uniques), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(first, codes, seq)
+
+    item_names=np.concatenate([
+        np.asarray(plan['proteins'], dtype=object),
+        np.array(['Nonsilent', 'MUT_All'], dtype=object),
+        np.asarray(plan['classes'], dtype=object)])
+    gene_codes=uniques//len(item_names)
+
+    candidate_features=pd.DataFrame({
+        'gene': counts['class_counts'].index.get_indexer(plan['genes'][gene_codes]),
+        'slot': first%_SLOT_COUNT,
+        'item': item_names[uniques%len(item_names)],
+        'first_row': first//_SLOT_COUNT-gene_codes*counts['rows']})
+
+    sample_positions=pd.Index(counts['samples']).get_indexer(sample_index)
+    return {'features': candidate_features, 'entries': (codes.astype(np.int64), sample_positions[samples])}
+
+def _merge_candidates(a, b):
+    '''
+    Internal function that combines candidates of an earlier run (a) with candidates of new rows (b)
+
+    Returns dict in the format returned by _candidates
+    '''
+    candidate_features=pd.concat([a['features'], b['features']], ignore_index=True)
+    groups=candidate_features.groupby(['gene', 'slot', 'item'], sort=False)
+    merged_codes=groups.ngroup().to_numpy()
+    candidate_features=groups['first_row'].min().reset_index()
+
+    features=merged_codes[np.concatenate([a['entries'][0], b['entries'][0]+len(a['features'])])]
+    samples=np.concatenate([a['entries'][1], b['entries'][1]])
+    n_samples=max(samples.max()+1 if len(samples) else 1, 1)
+    keys=np.unique(features*n_samples+samples)
+    return {'features': candidate_features, 'entries': (keys//n_samples, keys%n_samples)}
+
+def _candidate_entries(candidates, plan, sample_index, counts):
+    '''
+    Internal function that keeps the candidate features passing the thresholds of plan
+
+    Returns numpy arrays in the format returned by _variant_entries
+    '''
+    candidate_features=candidates['features']
+    gene_codes=plan['genes'].get_indexer(counts['class_counts'].index[candidate_features['gene'].to_numpy()])
+    slots=candidate_features['slot'].to_numpy()
+    items=candidate_features['item'].to_numpy()
+    known=gene_codes>=0
+    gene_codes=np.maximum(gene_codes, 0)
+
+    n_proteins=len(plan['proteins'])
+    codes=np.full(len(candidate_features), -1, dtype=np.int64)
+    keep=np.zeros(len(candidate_features), dtype=bool)
+    for slot, name in enumerate(_SELECT_SLOTS):
+        if not name in plan['slots']:
+            continue
+        in_slot=slots==slot
+        if name=='protein_change':
+            codes[in_slot]=plan['proteins'].get_indexer(items[in_slot])
+            keep[in_slot]=plan['keep_variant'][gene_codes[in_slot]]
+        elif name=='Nonsilent':
+            codes[in_slot]=n_proteins
+            keep[in_slot]=plan['keep_nonsilent'][gene_codes[in_slot]]
+        elif name=='MUT_All':
+            codes[in_slot]=n_proteins+1
+            keep[in_slot]=True
+        elif name=='variant_class':
+            class_codes=plan['classes'].get_indexer(items[in_slot])
+            codes[in_slot]=n_proteins+2+class_codes
+            keep[in_slot]=(class_codes>=0)&plan['keep_class'][gene_codes[in_slot], np.maximum(class_codes, 0)]
+    keep&=known&(codes>=0)
+
+    width=n_proteins+2+len(plan['classes'])
+    seq=(gene_codes*counts['rows']+candidate_features['first_row'].to_numpy())*_SLOT_COUNT+slots
+    features=gene_codes*width+codes
+
+    entry_features, entry_samples=candidates['entries']
+    kept=keep[entry_features]
+    sample_codes=sample_index.get_indexer(counts['samples'])
+    return seq[entry_features[kept]], features[entry_features[kept]], sample_codes[entry_samples[kept]]
+
+def _key_digest(key_df):
+    '''
+    Internal function returning a hash of the gene identifier to gene name mapping
+    '''
+    if key_df is None:
+        return None
+    return hashlib.sha1(pd.util.hash_pandas_object(key_df, index=True).to_numpy().tobytes()).hexdigest()
+
+def _write_sidecar(counts_file, counts, candidates, settings):
+    '''
+    Internal function that saves counts and candidates for a later run with previous_counts_file
+    '''
+    class_counts=counts['class_counts']
+    candidate_features=candidates['features']
+    arrays={
+        'settings': np.array(settings),
+        'rows': np.array(counts['rows']),
+        'class_counts': class_counts.to_numpy(dtype=np.int64),
+        'feature_genes': candidate_features['gene'].to_numpy(dtype=np.int64),
+        'feature_slots': candidate_features['slot'].to_numpy(dtype=np.int64),
+        'feature_first_rows': candidate_features['first_row'].to_numpy(dtype=np.int64),
+        'entry_features': np.asarray(candidates['entries'][0], dtype=np.int64),
+        'entry_samples': np.asarray(candidates['entries'][1], dtype=np.int64)}
+
+    for name, values in [('samples', counts['samples']), ('genes', class_counts.index),
+                         ('classes', class_counts.columns), ('variant_genes', counts['variants']['gene']),
+                         ('variant_proteins', counts['variants']['protein_change']),
+                         ('feature_items', candidate_features['item'])]:
+        values=np.asarray(values, dtype=object)
+        missing=np.asarray(pd.isna(values), dtype=bool)
+        arrays[name]=np.where(missing, '', values).astype(str)
+        arrays[name+'_missing']=missing
+
+    _savez(counts_file, compressed=True, **arrays)
+
+def _read_sidecar(counts_file):
+    '''
+    Internal function that loads a file written by _write_sidecar
+
+    Returns dict with 'settings', 'counts' and 'candidates'
+    '''
+    with np.load(counts_file) as archive:
+        labels={}
+        for name in ['samples', 'genes', 'classes', 'variant_genes', 'variant_proteins', 'feature_items']:
+            values=archive[name].astype(object)
+            values[archive[name+'_missing']]=np.nan
+            labels[name]=values
+
+        counts={
+            'rows': int(archive['rows']),
+            'samples': labels['samples'],
+            'class_counts': pd.DataFrame(archive['class_counts'], index=pd.Index(labels['genes'], dtype=object),
+                                         columns=pd.Index(labels['classes'], dtype=object)),
+            'variants': pd.DataFrame({'gene': labels['variant_genes'], 'protein_change': labels['variant_proteins']})}
+
+        candidates={
+            'features': pd.DataFrame({
+                'gene': archive['feature_genes'],
+                'slot': archive['feature_slots'],
+                'item': labels['feature_items'],
+                'first_row': archive['feature_first_rows']}),
+            'entries': (archive['entry_features'], archive['entry_samples'])}
+
+        return {'settings': str(archive['settings']), 'counts': counts, 'candidates': candidates}
+
+def _count_chunks(read_chunks, columns):
+    '''
+    Internal function that counts variants over every chunk returned by read_chunks
+
+    Returns dict in the format returned by _count_variants
+    '''
+    counts=_count_variants(pd.DataFrame(columns=list(columns), dtype=object), columns)
+    for ds in read_chunks():
+        counts=_merge_counts(counts, _count_variants(ds, columns))
+        reporter().progress(rows=counts['rows'])
+    return counts
+
+def _chunk_entries(read_chunks, plan, sample_index, columns, row_offset, total_rows):
+    '''
+    Internal function that collects one entry per feature and sample over every chunk returned
+    by read_chunks
+
+    row_offset - position of the first row of the first chunk among all rows
+    total_rows - number of rows in all files
+
+    Returns numpy arrays in the format returned by _variant_entries
+    '''
+    entries=[]
+    pending=0
+    kept=0
+    for ds in read_chunks():
+        entries.append(_reduce_entries(
+            *_variant_entries(ds, plan, sample_index, columns, row_offset, total_rows),
+            len(sample_index)))
+        row_offset+=len(ds)
+        reporter().progress(rows=row_offset)
+
+        #Compact once the new entries outgrow what was kept so far
+        pending+=len(entries[-1][0])
+        if pending>kept:
+            entries=[_reduce_entries(*_concatenate_entries(entries), len(sample_index))]
+            kept=len(entries[0][0])
+            pending=0
+
+    return _reduce_entries(*_concatenate_entries(entries), len(sample_index))
+
+def _sparse_table(entries, plan, sample_index):
+    '''
+    Internal function that builds the output matrix from a list of entries returned by
+    _chunk_entries
+
+    Returns scipy.sparse CSR matrix with features as rows and samples as columns, numpy array
+    of feature names and numpy array of sample names
+    '''
+    seq, features, samples=_reduce_entries(*_concatenate_entries(entries), len(sample_index))
+    names, features=_assemble_features(seq, features, plan)
+
+    message("Creating sparse matrix")
+    matrix=sparse.csr_matrix((np.ones(len(features), dtype=np.int8), (features, samples)),
+                             shape=(len(names), len(sample_index)))
+    #Features sharing a name are summed when building the matrix
+    matrix.data[:]=1
+    return matrix, np.asarray(names, dtype=object), np.asarray(sample_index, dtype=object)
+
+def _count_file(reader):
+    '''
+    Internal function run by the workers of produce_merged_variant_file to count one file
+
+    reader - tuple of arguments to _chunk_reader
+    '''
+    #Workers don't report, the stages are reported by produce_merged_variant_file
+    with reporting(None):
+        return _count_chunks(_chunk_reader(*reader), reader[2])
+
+def _file_entries(args):
+    '''
+    Internal function run by the workers of produce_merged_variant_file to collect the entries
+    of one file
+
+    args - tuple of arguments to _chunk_reader, plan, sample_index, row_offset and total_rows
+    '''
+    reader, plan, sample_index, row_offset, total_rows=args
+    with reporting(None):
+        return _chunk_entries(_chunk_reader(*reader), plan, sample_index, reader[2], row_offset, total_rows)
+
+def _chunk_reader(maf_input_file, key_df, columns, skiprows, chunksize, cache_dir, key_file, gene_identifier_format):
+    '''
+    Internal function that prepares reading a maf file for _vectorized_table. Without chunksize or
+    cache_dir the file is read now and kept in memory.
+
+    Returns function returning an iterable of pandas DataFrames without genes missing from key_df
+    '''
+    if cache_dir is not None:
+        cache_file=_cache_file(cache_dir, maf_input_file, columns, skiprows, key_file, gene_identifier_format)
+        ds=_read_cache(cache_file, columns)
+        if ds is None:
+            message("Caching file to "+cache_file)
+            chunks=_read_maf(maf_input_file, columns, skiprows, chunksize)
+            if chunksize is None:
+                chunks=[chunks]
+            ds=_write_cache((_known_genes(i, key_df, columns) for i in chunks), columns, cache_file)
+        return lambda: _split_rows(ds, chunksize)
+
+    elif chunksize is None:
+        message("Reading file...")
+        ds=_known_genes(_read_maf(maf_input_file, columns, skiprows), key_df, columns)
+        return lambda: [ds]
+
+    else:
+        return lambda: (_known_genes(i, key_df, columns)
+                        for i in _read_maf(maf_input_file, columns, skiprows, chunksize))
+
+def _split_rows(ds, chunksize=None):
+    '''
+    Internal function that yields chunks of chunksize rows of ds, or ds if chunksize is None
+    '''
+    if chunksize is None:
+        yield ds
+    else:
+        for i in range(0, len(ds), chunksize):
+            yield ds.iloc[i:i+chunksize]
+
+def _cache_file(cache_dir, maf_input_file, columns, skiprows, key_file, gene_identifier_format):
+    '''
+    Internal function that names the cache entry of a maf file read with the given settings
+    '''
+    key=[list(columns), skiprows, gene_identifier_format]
+    if isinstance(key_file, GeneKey):
+        key.append(key_file.digest(gene_identifier_format))
+        key_file=None
+
+    for path in [maf_input_file, key_file]:
+        if path:
+            stat=os.stat(path)
+            key+=[os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+        else:
+            key.append(None)
+
+    digest=hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, os.path.basename(maf_input_file)+'.'+digest+'.npz')
+
+def _write_cache(chunks, columns, cache_file):
+    '''
+    Internal function that stores the columns of a maf file as categorical codes
+
+    chunks - iterable of pandas DataFrames with the gene, sample, variant classification and
+             protein change columns
+    columns - tuple of the gene, sample, variant classification and protein change column names
+    cache_file - string - path returned by _cache_file
+
+    Returns pandas DataFrame of categorical columns, as returned by _read_cache
+    '''
+    categories=[pd.Index([], dtype=object) for i in columns]
+    codes=[[np.empty(0, dtype=np.int32)] for i in columns]
+
+    for ds in chunks:
+        for i, column in enumerate(columns):
+            chunk_codes, uniques=pd.factorize(ds[column])
+            new=~uniques.isin(categories[i])
+            categories[i]=categories[i].append(pd.Index(np.asarray(uniques[new], dtype=object)))
+
+            #Translate chunk codes into codes of all categories seen so far, keeping -1 for missing
+            lookup=np.append(categories[i].get_indexer(uniques), -1).astype(np.int32)
+            codes[i].append(lookup[chunk_codes])
+
+    arrays={}
+    for i in range(len(columns)):
+        arrays['codes_'+str(i)]=np.concatenate(codes[i])
+        #Fields of a tab separated file can't contain new lines
+        arrays['categories_'+str(i)]=np.frombuffer('\n'.join(categories[i]).encode(), dtype=np.uint8)
+        arrays['n_categories_'+str(i)]=np.array(len(categories[i]))
+
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    try:
+        _savez(cache_file, **arrays)
+    except FileNotFoundError:
+        #cache_dir was removed while writing, the table is built from the arrays anyway
+        pass
+
+    return _cached_frame(arrays, columns)
+
+def _read_cache(cache_file, columns):
+    '''
+    Internal function that loads a cache entry written by _write_cache
+
+    Returns pandas DataFrame of categorical columns or None if there is no entry
+    '''
+    try:
+        archive=np.load(cache_file)
+    except FileNotFoundError:
+        return None
+    message("Reading cached file "+cache_file)
+    with archive:
+        return _cached_frame(archive, columns)
+
+def _cached_frame(arrays, columns):
+    '''
+    Internal function that builds categorical columns from the arrays of a cache entry
+    '''
+    data={}
+    for i, column in enumerate(columns):
+        if int(arrays['n_categories_'+str(i)])==0:
+            categories=[]
+        else:
+            categories=bytes(arrays['categories_'+str(i)]).decode().split('\n')
+        data[column]=pd.Categorical.from_codes(arrays['codes_'+str(i)], categories=pd.Index(categories, dtype=object))
+    return pd.DataFrame(data, columns=list(columns))
+
+def _lookup(index, values):
+    '''
+    Internal function returning the position of each value in index, -1 if missing.
+    Categorical values are looked up once per category.
+
+    index - pandas Index with unique values
+    values - pandas Series
+    '''
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        lookup=np.append(index.get_indexer(values.cat.categories), index.get_indexer([np.nan]))
+        return lookup[values.cat.codes.to_numpy()]
+    return index.get_indexer(values)
+
+def _long_copy_number(ds, samples, copy_number_events, columns):
+    '''
+    Internal function that turns a wide gene by sample table of copy number calls into one row
+    per gene, sample and event, in row then sample order
+
+    Returns pandas DataFrame with columns named after columns
+    '''
+    values=ds[samples].to_numpy(dtype=float)
+    rows=[]
+    cols=[]
+    events=[]
+    for value, event in copy_number_events.items():
+        row, col=np.nonzero(values==value)
+        rows.append(row)
+        cols.append(col)
+        events.append(np.full(len(row), event, dtype=object))
+
+    rows=np.concatenate(rows)
+    cols=np.concatenate(cols)
+    order=np.lexsort((cols, rows))
+    rows=rows[order]
+    cols=cols[order]
+
+    return pd.DataFrame({
+        columns[0]: ds[columns[0]].to_numpy(dtype=object)[rows],
+        columns[1]: np.asarray(samples, dtype=object)[cols],
+        columns[2]: np.concatenate(events)[order],
+        columns[3]: np.full(len(rows), np.nan, dtype=object)})
+
+def _known_genes(ds, key_df, columns):
+    '''
+    Internal function that removes gene identifier rows that don't have a corresponding gene name
+    '''
+    if key_df is None:
+        return ds
+    return ds.loc[ds[columns[0]].isin(key_df.index)]
+
+def _sample_order(samples):
+    '''
+    Internal function that orders samples the way the output columns have always been
+    ordered (Python set order). Adding samples in order of appearance gives the same set
+    as adding every row.
+
+    samples - iterable of sample names
+    '''
+    return list(set(samples))
+
+def _count_variants(ds, columns):
+    '''
+    Internal function that counts variants per gene in one factorized pass over ds
+
+    ds - pandas DataFrame with the gene, sample, variant classification and protein change columns
+    columns - tuple of the gene, sample, variant classification and protein change column names
+
+    Returns dict with
+        'rows' - number of rows counted
+        'samples' - numpy array of samples in order of appearance
+        'class_counts' - pandas DataFrame of the number of rows per gene (rows, in order of
+                         appearance) and variant classification (columns)
+        'variants' - pandas DataFrame of unique 'gene' and 'protein_change' pairs. A missing
+                     protein change counts as one variant, as it does in the legacy engine
+    '''
+
+    gene_identifier, sample_identifier, mutation_classification_identifier, protein_change_identifier=columns
+
+    gene_codes, genes=pd.factorize(ds[gene_identifier])
+    class_codes, classes=pd.factorize(ds[mutation_classification_identifier], use_na_sentinel=False)
+    protein_codes, proteins=pd.factorize(ds[protein_change_identifier])
+    genes=pd.Index(np.asarray(genes, dtype=object), dtype=object)
+    classes=pd.Index(np.asarray(classes, dtype=object), dtype=object)
+
+    has_gene=gene_codes>=0
+    gene_codes=gene_codes[has_gene].astype(np.int64)
+    class_codes=class_codes[has_gene]
+    protein_codes=protein_codes[has_gene]
+
+    counts=np.bincount(gene_codes*len(classes)+class_codes, minlength=len(genes)*len(classes))
+    class_counts=pd.DataFrame(counts.reshape(len(genes), len(classes)), index=genes, columns=classes)
+
+    #Missing protein changes take the last slot of the lookup below
+    pairs=np.unique(gene_codes*(len(proteins)+1)+protein_codes+1)
+    protein_lookup=np.append(np.asarray(proteins, dtype=object), np.nan)
+    variants=pd.DataFrame({
+        'gene': genes.take(pairs//(len(proteins)+1)),
+        'protein_change': protein_lookup[pairs%(len(proteins)+1)-1]})
+
+    return {
+        'rows': len(ds),
+        'samples': np.asarray(pd.unique(ds[sample_identifier]), dtype=object),
+        'class_counts': class_counts,
+        'variants': variants}
+
+def _merge_counts(a, b):
+    '''
+    Internal function that combines the counts of two parts of a file, a before b
+
+    a, b - dicts returned by _count_variants
+
+    Returns dict in the same format
+    '''
+    a_counts=a['class_counts']
+    b_counts=b['class_counts']
+    genes=a_counts.index.append(b_counts.index[~b_counts.index.isin(a_counts.index)])
+    classes=a_counts.columns.append(b_counts.columns[~b_counts.columns.isin(a_counts.columns)])
+
+    class_counts=(a_counts.reindex(index=genes, columns=classes, fill_value=0)
+                  +b_counts.reindex(index=genes, columns=classes, fill_value=0))
+
+    return {
+        'rows': a['rows']+b['rows'],
+        'samples': pd.unique(np.concatenate([a['samples'], b['samples']])),
+        'class_counts': class_counts,
+        'variants': pd.concat([a['variants'], b['variants']], ignore_index=True).drop_duplicates()}
+
+def _feature_plan(counts, key_df, is_copy_number, variant_thres, change_thres,
+                  genes_with_all_entries, only_select_from_list):
+    '''
+    Internal function that decides which features each gene produces
+
+    counts - dict returned by _count_variants
+    key_df - pandas Series mapping gene identifiers to gene names or None
+
+    Returns dict with
+        'genes' - pandas Index of genes in output order
+        'names' - numpy array of gene names used in the feature names
+        'proteins' - pandas Index of protein changes
+        'classes' - pandas Index of variant classifications
+        'keep_variant' - boolean array, genes whose protein changes are kept
+        'keep_nonsilent' - boolean array, genes whose Nonsilent feature is kept
+        'keep_class' - boolean array of genes by variant classifications that are kept
+        'slots' - tuple of features created for each row (see _MUTATION_SLOTS)
+    '''
+
+    class_counts=counts['class_counts']
+    classes=class_counts.columns
+    proteins=pd.Index(counts['variants']['protein_change'].dropna().unique())
+
+    if genes_with_all_entries is None:
+        genes_with_all_entries=[]
+
+    if only_select_from_list or (is_copy_number and genes_with_all_entries):
+        if only_select_from_list:
+            message("Selecting from list of genes...")
+            slots=_SELECT_SLOTS
+        else:
+            message("Creating index...")
+            slots=_COPY_NUMBER_SLOTS
+
+        genes=pd.Index(list(dict.fromkeys(genes_with_all_entries)), dtype=object)
+        keep_class=np.ones((len(genes), len(classes)), dtype=bool)
+        keep_class[:, np.asarray(classes.isna())]=False
+
+        return {
+            'genes': genes,
+            'names': np.asarray(genes, dtype=object),
+            'proteins': proteins,
+            'classes': classes,
+            'keep_variant': np.ones(len(genes), dtype=bool),
+            'keep_nonsilent': np.ones(len(genes), dtype=bool),
+            'keep_class': keep_class,
+            'slots': slots}
+
+    message("Counting each type of variant...")
+    genes=class_counts.index
+    if key_df is None:
+        names=np.asarray(genes, dtype=object)
+    else:
+        names=key_df.reindex(genes).to_numpy(dtype=object)
+
+    values=class_counts.to_numpy()
+    variant_counts=counts['variants'].groupby('gene', sort=False).size().reindex(genes, fill_value=0).to_numpy()
+
+    #The legacy engine only adds to Nonsilent for classifications it has already seen,
+    #so the first row of every nonsilent classification after the first is not counted
+    nonsilent=values[:, np.asarray(classes!='Silent')]
+    nonsilent_rows=nonsilent.sum(axis=1)
+    nonsilent_counts=nonsilent_rows-(nonsilent>0).sum(axis=1)+1
+
+    message("Dropping variants under threshold...")
+    exempt=pd.Index(names).isin(genes_with_all_entries)
+    keep_class=(values>0)&(exempt[:, None]|(values>=change_thres))
+    keep_class[:, np.asarray(classes.isna())]=False
+
+    return {
+        'genes': genes,
+        'names': names,
+        'proteins': proteins,
+        'classes': classes,
+        'keep_variant': exempt|(variant_counts>=variant_thres),
+        'keep_nonsilent': (nonsilent_rows>0)&(exempt|(nonsilent_counts>=change_thres)),
+        'keep_class': keep_class,
+        #Genome wide copy number keeps every gene and copy number event over change_thres
+        'slots': _COPY_NUMBER_SLOTS if is_copy_number else _MUTATION_SLOTS}
+
+def _variant_entries(ds, plan, sample_index, columns, row_offset=0, total_rows=None):
+    '''
+    Internal function that finds the features set by each row of ds
+
+    ds - pandas DataFrame with the gene, sample, variant classification and protein change columns
+    plan - dict returned by _feature_plan
+    sample_index - pandas Index of samples in output order
+    columns - tuple of the gene, sample, variant classification and protein change column names
+    row_offset - position of the first row of ds in the whole file
+    total_rows - number of rows in the whole file, defaults to len(ds)
+
+    Returns numpy arrays with, for each entry, the order in which the legacy engine would
+    create it, the feature code (see _feature_names) and the sample column
+    '''
+
+    gene_identifier, sample_identifier, mutation_classification_identifier, protein_change_identifier=columns
+    if total_rows is None:
+        total_rows=len(ds)
+
+    gene_codes=_lookup(plan['genes'], ds[gene_identifier])
+    rows=np.flatnonzero(gene_codes>=0)
+    gene_codes=gene_codes[rows].astype(np.int64)
+
+    variant_classes=ds[mutation_classification_identifier].iloc[rows]
+    class_codes=_lookup(plan['classes'], variant_classes)
+    protein_codes=_lookup(plan['proteins'], ds[protein_change_identifier].iloc[rows])
+    sample_codes=_lookup(sample_index, ds[sample_identifier].iloc[rows])
+
+    n_proteins=len(plan['proteins'])
+    items=np.full((len(rows), _SLOT_COUNT), -1, dtype=np.int64)
+    for slot in plan['slots']:
+        if slot=='protein_change':
+            keep=plan['keep_variant'][gene_codes]&(protein_codes>=0)
+            items[:, 0]=np.where(keep, protein_codes, -1)
+        elif slot=='Nonsilent':
+            keep=plan['keep_nonsilent'][gene_codes]&np.asarray(variant_classes!='Silent')
+            items[:, 1]=np.where(keep, n_proteins, -1)
+        elif slot=='MUT_All':
+            items[:, 3]=n_proteins+1
+        elif slot=='variant_class':
+            keep=(class_codes>=0)&plan['keep_class'][gene_codes, np.maximum(class_codes, 0)]
+            items[:, 2]=np.where(keep, n_proteins+2+class_codes, -1)
+
+    #Legacy engine goes gene by gene, then row by row, then slot by slot
+    width=n_proteins+2+len(plan['classes'])
+    seq=((gene_codes*total_rows+row_offset+rows)*_SLOT_COUNT)[:, None]+np.arange(_SLOT_COUNT)
+    features=gene_codes[:, None]*width+items
+    valid=items>=0
+
+    return (seq[valid], features[valid], np.broadcast_to(sample_codes[:, None], items.shape)[valid])
+
+def _reduce_entries(seq, features, samples, n_samples):
+    '''
+    Internal function that keeps the earliest entry for each feature and sample
+
+    seq, features, samples - numpy arrays returned by _variant_entries
+    n_samples - number of samples in the output
+
+    Returns numpy arrays in the same format
+    '''
+    n_samples=max(n_samples, 1)
+    first=pd.Series(seq).groupby(features*n_samples+samples, sort=False).min()
+    keys=first.index.to_numpy()
+    return first.to_numpy(), keys//n_samples, keys%n_samples
+
+def _concatenate_entries(entries):
+    '''
+    Internal function that joins a list of (seq, features, samples) tuples
+    '''
+    empty=np.empty(0, dtype=np.int64)
+    return tuple(np.concatenate([empty]+[entry[i] for entry in entries]).astype(np.int64) for i in range(3))
+
+def _feature_names(features, plan):
+    '''
+    Internal function that turns feature codes into feature names
+
+    A feature code is gene*width+item where items are the protein changes, then Nonsilent
+    and MUT_All, then the variant classifications
+    '''
+    item_names=np.concatenate([
+        np.asarray(plan['proteins'], dtype=object),
+        np.array(['Nonsilent', 'MUT_All'], dtype=object),
+        np.asarray(plan['classes'], dtype=object)])
+    width=len(item_names)
+    return np.asarray(plan['names'], dtype=object)[features//width]+'_'+item_names[features%width]
+
+def _assemble_features(seq, features, plan):
+    '''
+    Internal function that orders features the way the legacy engine creates them
+
+    seq, features - numpy arrays returned by _variant_entries
+
+    Returns numpy array of feature names and the row of each entry in that array
+    '''
+    codes, uniques=pd.factorize(features)
+    first=np.full(len(uniques), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(first, codes, seq)
+
+    order=np.argsort(first, kind='stable')
+    rank=np.empty_like(order)
+    rank[order]=np.arange(len(order))
+
+    #Different items can share a name (ex. a protein change spelled like a classification)
+    name_codes, names=pd.factorize(_feature_names(uniques[order], plan))
+    return names, name_codes[rank[codes]]
@@ -0,0 +1,26 @@
+import importlib
+
+#Submodules, and public names with the submodule defining each, imported on first use (PEP 562)
+_SUBMODULES = ['colorscales', 'silhouette', 'stacked_bar']
+_PUBLIC = {
+    'make_color_annotations': 'colorscales',
+    'annotation_dataframe': 'colorscales',
+    'stacked_bar_table': 'stacked_bar',
+    'silhouette_samples': 'silhouette',
+    'plot_silhouettes': 'silhouette',
+    }
+__all__ = sorted(set(_SUBMODULES) | set(_PUBLIC))
+
+def __getattr__(name):
+    if name in _PUBLIC:
+        value = getattr(importlib.import_module(__name__+'.'+_PUBLIC[name]), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module(__name__+'.'+name)
+    else:
+        raise AttributeError("module "+repr(__name__)+" has no attribute "+repr(name))
+    #Later accesses find the name without calling __getattr__
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return __all__
@@ -6,7 +6,7 @@ Stephanie.Ting.3@gmail.com
 7/24/2023
 
 Last edited:
-7/31/2025
+10/17/2026
 '''
 
 import matplotlib.pyplot as plt
@@ -27,42 +27,29 @@ LUMINAL_A = "#2F3492"
 LUMINAL_B = "#26AFDD"
 NORMAL = "#3CB54C"
 
-def _mpl_normalize(s, method, cmap='vlag', **kwargs):
-
+def _mpl_rgba(s, method, cmap='vlag', **kwargs):
     '''
-    Internal function that maps continuous variable to 
-    matplotlib colormap
+    Internal function that maps continuous variable to matplotlib colormap
+    with one call to to_rgba over the whole array
 
     s - pandas Series to be mapped
     cmap - String name of acceptable matplotlib colormap
     method - Normalization function for normalizing data to [0,1] scale
     **kwargs - args for normalization function
 
-    Returns pandas Series object
+    Returns numpy array of rgba values with shape (len(s), 4)
     '''
 
-    # Make sure dtype is numeric
-    s=s.astype(float)
-
     # Create mapper using desired method and colormap
     norm = method(**kwargs)
     mapper = cm.ScalarMappable(norm=norm, cmap=get_cmap(cmap))
 
-    return((s.map(lambda x: mapper.to_rgba(x)),))
+    return(mapper.to_rgba(np.asarray(s, dtype=float)).astype(float))
 
-def _map_categorical_colors(s, values, dtype = 'categorical', custom_colors = None):
+def _categorical_color_dict(values, dtype = 'categorical', custom_colors = None):
     '''
-    Internal function that maps a categorical or binary variable to 
-    sns color palettes.
-
-    s - pandas Series to be mapped
-    values - values in pandas Series
-    dtype - 'categorical', 'pam50', or 'binary' - determines what color 
-                            color palette will be used
-
-    Returns pandas Series object
+    Internal function returning the dict of value:color for a categorical or binary variable
     '''
-    
     if custom_colors == None:
         if dtype == 'categorical':
             colorscheme = [i+(1,) for i in sns.color_palette("bright")+sns.color_palette("pastel")+sns.color_palette("dark")]
@@ -84,10 +71,80 @@ def _map_categorical_colors(s, values, dtype = 'categorical', custom_colors = No
     else:
         color_dict = custom_colors
 
-    #Return color key as well for referencing
-    return((s.map(color_dict), color_dict))
+    return(color_dict)
+
+def _color_lookup(names, color_dict):
+    '''
+    Internal function returning object numpy array of the color of each name, NaN where
+    color_dict has none, with an extra NaN at the end for missing codes
+    '''
+    lookup = np.empty(len(names)+1, dtype=object)
+    lookup[:] = [color_dict.get(i, np.nan) for i in names]+[np.nan]
+    return(lookup)
+
+def _lookup_rgba(lookup):
+    '''
+    Internal function converting an object array of colors (NaN for none) to an rgba array
+    '''
+    rgba = np.full((len(lookup), 4), np.nan)
+    for i, color in enumerate(lookup):
+        if not (isinstance(color, float) and np.isnan(color)):
+            rgba[i] = matplotlib.colors.to_rgba(color)
+    return(rgba)
+
+def _track_colors(group, dtype, column, normalization_method, normalization_center, color_value_order, custom_colors):
+    '''
+    Internal function mapping one column of make_color_annotations
+
+    Returns tuple of numpy rgba array (len(group), 4), function returning the colors as a
+    pandas Series (as make_color_annotations always returned them), and color key
+    '''
+    if dtype == "continuous":
+        group=group.astype(float)
+        if normalization_method == "linear":
+            q = group.quantile([0.25, 0.75]).to_numpy()
+            rgba = _mpl_rgba(group, matplotlib.colors.Normalize, vmin=q[0], vmax=q[1])
+            key = {"0.25":q[0], "0.75": q[1]}
+
+        elif normalization_method == "centered":
+            if normalization_center == "median":
+                normalization_center = np.median(group.values)
+
+            rgba = _mpl_rgba(group, matplotlib.colors.CenteredNorm, vcenter = normalization_center)
+            key = None
+        else:
+            raise AssertionError(
+                    "method must be \"linear\" or \"centered\""
+            )
+
+        view = lambda: pd.Series(list(map(tuple, rgba.tolist())), index=group.index, name=column)
+        return((rgba, view, key))
+
+    #Values are mapped through their string form, once per distinct value
+    codes, uniques = pd.factorize(group, use_na_sentinel=False)
+    names = [str(i) for i in uniques]
+
+    #This is to control the order that values are assigned to colors
+    #If an order is preferred
+    if not color_value_order==None and column in color_value_order:
+        if type(color_value_order[column]) == list and  len(color_value_order[column]) == len(set(names)):
+            value_order = color_value_order[column]
+        else:
+            raise AssertionError(
+                    "color_value_order must be a dict with column names as keys and list of values to map as values"
+                    )
+    else:
+        value_order = sorted(set(names))
+
+    color_dict = _categorical_color_dict(value_order, dtype, custom_colors)
+    lookup = _color_lookup(names, color_dict)
+    rgba = _lookup_rgba(lookup)[codes]
+
+    view = lambda: pd.Series(lookup[codes], index=group.index, name=column)
+    return((rgba, view, color_dict))
 
-def make_color_annotations(ds, datatype, normalization_method = "linear", normalization_center = 0, color_value_order = None, custom_colors = None):
+def make_color_annotations(ds, datatype, normalization_method = "linear", normalization_center = 0, color_value_order = None, custom_colors = None,
+                           output = "dataframe"):
 
     '''
     Makes a color annotation pandas Series or DataFrame mapping value to rgba value 
@@ -105,9 +162,17 @@ def make_color_annotations(ds, datatype, normalization_method = "linear", normal
                         
                         for binary colors the colors are in order of black, gray, white 
     normalization_center - numeric value or "median" for continuous data type to center normalization on
-                           if normalization method = "centered"
+                           if normalization method = "centered". "median" is the median of each column
                            TODO: allow to take functions
     custom_colors - python dict containing value:colors for custom colors. If None, default colors
+    output - "dataframe" returns a pandas DataFrame with the columns of ds as rows and the rows of ds
+             as columns holding colors (rgba tuples for continuous columns, the palette's colors for
+             the others). "array" returns a numpy float array of rgba values with shape
+             (number of columns, number of rows, 4), without building the DataFrame. Categorical
+             values without a color are NaN, missing continuous values get the colormap's "bad"
+             color (0, 0, 0, 0). Turn it into the DataFrame with annotation_dataframe
+
+    Returns tuple of the colors and a dict of the color key of each column
     '''
     
     if not len(datatype) == ds.shape[1]:
@@ -120,59 +185,45 @@ def make_color_annotations(ds, datatype, normalization_method = "linear", normal
                 "ds should be of type pandas DataFrame"
                 )
 
+    if not output in ["dataframe", "array"]:
+        raise AssertionError(
+                "output must be \"dataframe\" or \"array\""
+                )
+
+    return_rgba=np.empty((ds.shape[1], ds.shape[0], 4))
     return_series=[]
     return_keys=[]
 
-    for column, dtype in zip(ds.columns, datatype):
-        group=ds.loc[:, column]
-
+    for i, (column, dtype) in enumerate(zip(ds.columns, datatype)):
         if not dtype in ["continuous", "categorical", "pam50", "binary"]:
             raise AssertionError(
                     "datatype must be \"continuous\", \"categorical\", \"pam50\", or \"binary\""
                     )
-               
-        if dtype == "continuous":
-            group=group.astype(float)
-            if normalization_method == "linear":
-                return_series.append(_mpl_normalize(group, matplotlib.colors.Normalize,
-                                                    vmin=group.quantile(0.25),
-                                                    vmax=group.quantile(0.75))[0])
-                return_keys.append({"0.25":group.quantile(0.25), "0.75": group.quantile(0.75)})
-
-            elif normalization_method == "centered":
-                if normalization_center == "median":
-                    normalization_center = np.median(group.values)
-
-                return_series.append(_mpl_normalize(group, matplotlib.colors.CenteredNorm,
-                                                    vcenter = normalization_center
-                                                    )[0])
-                return_keys.append(None)
-            else:
-                raise AssertionError(
-                        "method must be \"linear\" or \"centered\""
 
-            )             
-        else:
-            #This is to control the order that values are assigned to colors
-            #If an order is preferred
-            if not color_value_order==None and column in color_value_order:
-                if type(color_value_order[column]) == list and  len(color_value_order[column]) == len(set(group.values)):
-                    value_order = color_value_order[column]
-                else:
-                    raise AssertionError(
-                            "color_value_order must be a dict with column names as keys and list of values to map as values"
-                            )
-            else:
-                value_order = [str(i) for i in set(group.values)]
-                value_order.sort()
+        rgba, view, key = _track_colors(ds.iloc[:, i], dtype, column, normalization_method, normalization_center,
+                                        color_value_order, custom_colors)
+        return_rgba[i] = rgba
+        if output == "dataframe":
+            return_series.append(view())
+        return_keys.append(key)
+
+    if output == "array":
+        return((return_rgba, dict(zip(ds.columns, return_keys))))
 
-                   
-            cat_colors = _map_categorical_colors(group.astype(str), value_order, dtype, custom_colors)
-            return_series.append(cat_colors[0])
-            return_keys.append(cat_colors[1])
-    
     return_df=pd.DataFrame(return_series)
     return((return_df,dict(zip(return_df.index, return_keys))))
-        
-        
 
+def annotation_dataframe(rgba, tracks, samples):
+    '''
+    Turns the array returned by make_color_annotations(..., output = "array") into a pandas
+    DataFrame of rgba tuples (NaN where the array is NaN) for seaborn clustermap
+
+    rgba - numpy array of shape (number of tracks, number of samples, 4)
+    tracks - list-like of track names (the columns of ds)
+    samples - list-like of sample names (the rows of ds)
+    '''
+    values = np.empty(rgba.shape[:2], dtype=object)
+    missing = np.isnan(rgba).any(axis=2)
+    values[missing] = np.nan
+    values[~missing] = np.fromiter(map(tuple, rgba[~missing].tolist()), dtype=object, count=int((~missing).sum()))
+    return(pd.DataFrame(values, index=tracks, columns=samples))
@@ -1,18 +1,216 @@
+import mmap
 import seaborn as sns
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from sklearn.metrics import silhouette_sample, silhouette_score
+from matplotlib.collections import PolyCollection
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from scipy.spatial.distance import cdist
 
+#Arrays shared with the block workers, set once per worker by _init_worker
+_WORKER_STATE = None
 
-def plot_silhouettes(df, labels, avg_line=True, save_file=None):
+def silhouette_samples(X, labels, metric='euclidean', distances=None, sample_size=None, random_state=0,
+                       chunk_size=1024, n_workers=1, pool='process'):
+    '''
+    Silhouette score of every sample, computed chunk_size samples at a time so the full pairwise
+    distance matrix is never held in memory. Matches sklearn.metrics.silhouette_samples when exact,
+    samples alone in their cluster score 0.
+
+    X - numpy array or pandas DataFrame of samples by features. Ignored if distances is given
+    labels - list-like of cluster labels per sample
+    metric - string - any metric of scipy.spatial.distance.cdist
+    distances - numpy array (or memory mapped array) of precomputed samples by samples distances,
+                read chunk_size rows at a time. Worker processes reopen a memory mapped file
+                rather than receive a copy; other arrays are shared with worker threads instead
+                of processes
+    sample_size - int - if given, scores are approximated from at most sample_size randomly chosen
+                        members of each cluster: mean distances to a cluster are taken over its
+                        chosen members only, so memory and time grow with the number of chosen
+                        samples instead of the number of samples
+    random_state - int - seed used to choose the members when sample_size is given
+    chunk_size - int - number of samples whose distances are computed at once
+    n_workers - int - number of chunks computed at the same time. None uses the number of processors
+    pool - string - "process" or "thread", the kind of pool used when n_workers is not 1
+
+    Returns numpy array of silhouette scores in the order of labels
+    '''
+    if not pool in ['process', 'thread']:
+        raise AssertionError(
+                "pool must be \"process\" or \"thread\""
+                )
+
+    codes, clusters = pd.factorize(np.asarray(labels))
+    if (codes < 0).any():
+        raise AssertionError(
+                "labels must not be missing"
+                )
+    n = len(codes)
+
+    #Reference samples distances are measured to: every sample, or a stratified sample
+    if sample_size is None:
+        reference = np.arange(n)
+    else:
+        rng = np.random.default_rng(random_state)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(clusters)))])
+        reference = np.sort(np.concatenate([rng.choice(order[bounds[i]:bounds[i+1]],
+                                                       min(sample_size, bounds[i+1]-bounds[i]), replace=False)
+                                            for i in range(len(clusters))]))
+
+    if distances is None:
+        X = np.asarray(X, dtype=float)
+        if len(X) != n:
+            raise AssertionError(
+                    "X and labels must have the same number of samples"
+                    )
+        reference_values = X[reference]
+    else:
+        if distances.shape != (n, n):
+            raise AssertionError(
+                    "distances must be a square matrix with one row per label"
+                    )
+        reference_values = None
+
+    #Indicator of the cluster of each reference sample, and each cluster's reference size
+    reference_codes = codes[reference]
+    members = np.zeros((len(reference), len(clusters)))
+    members[np.arange(len(reference)), reference_codes] = 1
+    state = {'X': X if distances is None else None, 'distances': distances, 'metric': metric,
+             'reference': reference, 'reference_values': reference_values, 'members': members,
+             'reference_norms': None if reference_values is None else (reference_values*reference_values).sum(axis=1)}
+
+    blocks = [(start, min(start+chunk_size, n)) for start in range(0, n, chunk_size)]
+    if n_workers == 1:
+        sums = [_block_sums(block, state) for block in blocks]
+    else:
+        worker_state = state
+        if pool == 'process' and distances is not None:
+            if _is_file_memmap(distances):
+                #Workers reopen the file, a pickled memmap is a full copy in memory
+                worker_state = dict(state, distances=None, memmap=(distances.filename, distances.dtype, distances.shape,
+                                                                   distances.offset, 'F' if _fortran_only(distances) else 'C'))
+            else:
+                #Distances in memory would be copied into every process, threads share them
+                pool = 'thread'
+        executor = ProcessPoolExecutor if pool == 'process' else ThreadPoolExecutor
+        with executor(max_workers=n_workers, initializer=_init_worker, initargs=(worker_state,)) as e:
+            sums = list(e.map(_worker_block_sums, blocks))
+    sums = np.concatenate(sums) if sums else np.empty((0, len(clusters)))
+
+    #Mean distance to each cluster, leaving the sample out of its own cluster
+    counts = np.tile(np.bincount(reference_codes, minlength=len(clusters)).astype(float), (n, 1))
+    in_reference = np.zeros(n, dtype=bool)
+    in_reference[reference] = True
+    counts[np.flatnonzero(in_reference), codes[in_reference]]-=1
+    own_counts = counts[np.arange(n), codes]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums/counts
+    a = means[np.arange(n), codes]
+    means[np.arange(n), codes] = np.inf
+    means[counts == 0] = np.inf
+    b = means.min(axis=1, initial=np.inf)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = (b-a)/np.maximum(a, b)
+    #Alone in their cluster, or no other cluster
+    scores[(own_counts == 0) | ~np.isfinite(b)] = 0
+    return np.nan_to_num(scores)
+
+def _block_sums(block, state):
+    '''
+    Internal function returning the summed distances of the samples of block (start, stop) to the
+    reference members of each cluster
+    '''
+    start, stop = block
+    if state['distances'] is None and state['metric'] == 'euclidean':
+        #Matrix product form, as sklearn's euclidean_distances, much faster than cdist
+        x = state['X'][start:stop]
+        d = (x*x).sum(axis=1)[:, None]-2*x@state['reference_values'].T+state['reference_norms'][None, :]
+        d = np.sqrt(np.maximum(d, 0))
+    elif state['distances'] is None:
+        d = cdist(state['X'][start:stop], state['reference_values'], metric=state['metric'])
+    else:
+        d = np.asarray(state['distances'][start:stop], dtype=float)[:, state['reference']]
+    return d@state['members']
+
+def _init_worker(state):
+    global _WORKER_STATE
+    if state.get('memmap') is not None:
+        filename, dtype, shape, offset, order = state['memmap']
+        state = dict(state, distances=np.memmap(filename, dtype=dtype, mode='r', shape=shape, offset=offset, order=order))
+    _WORKER_STATE = state
+
+def _is_file_memmap(a):
+    '''
+    Internal function returning True for a memory mapped array opened on a file, not a view of one
+    '''
+    return isinstance(a, np.memmap) and a.filename is not None and isinstance(a.base, mmap.mmap) and \
+        (a.flags.c_contiguous or a.flags.f_contiguous)
+
+def _fortran_only(a):
+    return a.flags.f_contiguous and not a.flags.c_contiguous
+
+def _worker_block_sums(block):
+    return _block_sums(block, _WORKER_STATE)
+
+def plot_silhouettes(df, labels, avg_line=True, save_file=None, metric='euclidean', distances=None,
+                     sample_size=None, random_state=0, chunk_size=1024, n_workers=1, pool='process', ax=None):
     '''
     Plot silhouette scores of pre-generated clustering labels
 
-    df - pandas DataFrame of data from which clusters were generated
-    labels - pandas DataFrame of pregenerated labels per sample
+    df - pandas DataFrame of data from which clusters were generated, samples as rows
+    labels - pandas DataFrame of pregenerated labels per sample (first column), or pandas Series,
+             matched to df by index
+    avg_line - if True draws a dashed line at the average score
+    save_file - path to save the plot to
+    metric, distances, sample_size, random_state, chunk_size, n_workers, pool - see silhouette_samples
+    ax - matplotlib Axes to draw on, if None a new figure
 
-    Plots silhouette scores by cluster label and saves plot if given path
+    Plots silhouette scores by cluster label and saves plot if given path. Each cluster is drawn as
+    one band of its scores sorted descending, all clusters in a single collection.
+
+    Returns tuple of the matplotlib Axes and pandas Series of silhouette scores per sample
     '''
+    if isinstance(labels, pd.DataFrame):
+        labels = labels.iloc[:, 0]
+    labels = labels.reindex(df.index)
+
+    scores = pd.Series(silhouette_samples(df, labels, metric=metric, distances=distances, sample_size=sample_size,
+                                          random_state=random_state, chunk_size=chunk_size, n_workers=n_workers,
+                                          pool=pool),
+                       index=df.index, name='silhouette')
+
+    #Samples sorted by cluster, then by descending score within clusters
+    codes, clusters = pd.factorize(labels, sort=True)
+    order = np.lexsort((-scores.to_numpy(), codes))
+    sorted_scores = scores.to_numpy()[order]
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(clusters)))])
+    gap = max(1, len(codes)//100)
+    offsets = bounds[:-1]+gap*np.arange(len(clusters))
+
+    #Band of each cluster: the outline of its sorted scores, closed at x = 0
+    bands = []
+    for i in range(len(clusters)):
+        y = offsets[i]+np.arange(bounds[i+1]-bounds[i])
+        x = sorted_scores[bounds[i]:bounds[i+1]]
+        bands.append(np.concatenate([[[0, offsets[i]]], np.column_stack([x, y]), [[0, y[-1] if len(y) else offsets[i]]]]))
+    colors = sns.color_palette("bright", len(clusters))
+
+    if ax is None:
+        fig, ax = plt.subplots()
+    ax.add_collection(PolyCollection(bands, facecolors=colors, edgecolors=colors, linewidths=0.5))
+    ax.set_yticks(offsets+np.diff(bounds)/2)
+    ax.set_yticklabels([str(i) for i in clusters])
+    ax.set_xlim(min(-0.1, sorted_scores.min(initial=0)-0.05), 1)
+    ax.set_ylim(-gap, offsets[-1]+bounds[-1]-bounds[-2]+gap if len(clusters) else 1)
+    ax.set_xlabel("silhouette score")
+    ax.set_ylabel("cluster")
+
+    if avg_line:
+        ax.axvline(scores.mean(), color="red", linestyle="--")
 
+    if save_file is not None:
+        plt.savefig(save_file, bbox_inches="tight")
 
+    return((ax, scores))
@@ -1,46 +1,116 @@
 import pandas as pd
 import numpy as np
-import seaborn as sns
 import matplotlib.pyplot as plt
+from matplotlib.collections import PolyCollection
+from matplotlib.patches import Patch
 
-def stacked_bar(df, x, y, stacks = None, color_dict = None, x_order = None):
+def stacked_bar(df, x, y, stacks = None, color_dict = None, x_order = None, normalize = False, ax = None, show = True,
+                max_xticks = 100):
     '''
-    Wrapper to make a seaborn stacked bar plot
+    Draws a stacked bar plot with matplotlib
 
     df - dataframe where columns are data categories
-    x - data category (df column) for the x axis 
+    x - data category (df column) for the x axis
     y - data category (df column) for the stacks
     stacks - data category (df column) of stack proportions if values == "prop"
     colors - optional parameter for customizing colors format: [(value: color), (value: color),...]
+             or a dict of value: color. The first value is stacked on top and the last at the
+             bottom, with the values not listed counted in the last one
+    x_order - list of x values in the order they are drawn. If None, x values are drawn in
+              ascending order of their totals
+    normalize - if True each bar shows proportions of its total instead of counts
+    ax - matplotlib Axes to draw on, if None the current Axes
+    show - if True calls plt.show()
+    max_xticks - int - most x values labelled, past it every n-th x value is labelled
 
+    All layers are drawn at once as one PolyCollection of rectangles from the table of
+    stacked_bar_table.
+
+    Returns the matplotlib Axes
+    '''
+    table = stacked_bar_table(df, x, y, stacks, color_dict, x_order, normalize)
+    colors = [color for an, color in _color_items(color_dict)]
+
+    if ax is None:
+        ax = plt.gca()
+
+    #Rectangles of every layer at once: layer i sits on the layers below it, the last listed
+    #value at the bottom
+    heights = table.to_numpy(dtype=float).T[::-1]
+    tops = np.cumsum(heights, axis=0)
+    bottoms = tops-heights
+    n_layers, n_xs = heights.shape
+    left = np.tile(np.arange(n_xs)-0.4, n_layers)
+    right = left+0.8
+    verts = np.stack([np.column_stack([left, bottoms.ravel()]),
+                      np.column_stack([left, tops.ravel()]),
+                      np.column_stack([right, tops.ravel()]),
+                      np.column_stack([right, bottoms.ravel()])], axis=1)
+    ax.add_collection(PolyCollection(verts, facecolors=[color for color in colors[::-1] for i in range(n_xs)],
+                                     edgecolors='none'))
+
+    ax.set_xlim(-0.5, n_xs-0.5)
+    ax.set_ylim(0, max(tops.max(initial=0), 1e-9)*1.05)
+    #Label at most max_xticks bars, ticks are slow to draw and unreadable past that
+    step = -(-n_xs//max_xticks)
+    ax.set_xticks(np.arange(0, n_xs, step))
+    ax.set_xticklabels([str(i) for i in table.index[::step]], rotation=90 if n_xs > 30 else 0)
+    ax.set_xlabel(x)
+    ax.set_ylabel("proportion" if normalize else "count")
+    #A fixed legend position, "best" searches every rectangle on each draw
+    ax.legend(handles=[Patch(color=color, label=str(an)) for an, color in _color_items(color_dict)],
+              title=y, loc='upper left', bbox_to_anchor=(1, 1))
+
+    if show:
+        plt.show()
+    return ax
+
+def stacked_bar_table(df, x, y, stacks = None, color_dict = None, x_order = None, normalize = False):
+    '''
+    Builds the table drawn by stacked_bar in one pass over df
+
+    df, x, y, stacks, color_dict, x_order, normalize - see stacked_bar
+
+    Returns pandas DataFrame with x values as index and the values of color_dict as columns,
+    holding counts (or rounded percents summed from stacks) of each x and stack value. The last
+    column also counts the values not in color_dict.
     '''
-    if stacks == None:
-        bp_df = df.loc[:, [x, y]] 
+    values = [an for an, color in _color_items(color_dict)]
+
+    #Values not listed count towards the last listed value
+    layer = df[y].where(df[y].isin(values[:-1]), values[-1]) if values else df[y]
+
+    #The crosstab as one bincount over pairs of x and layer codes
+    x_codes, xs = pd.factorize(df[x])
+    layer_codes = pd.Index(values).get_indexer(layer)
+    keep = (x_codes >= 0) & (layer_codes >= 0)
+    weights = None if stacks == None else round(df[stacks]*100).to_numpy(dtype=float)[keep]
+    counts = np.bincount(x_codes[keep]*len(values)+layer_codes[keep], weights=weights,
+                         minlength=len(xs)*len(values)).reshape(len(xs), len(values))
+    table = pd.DataFrame(counts, index=xs, columns=values)
+
+    if x_order is None:
+        table = table.loc[table.sum(axis=1).sort_values(kind='stable').index]
     else:
-        bp_df = df.loc[:, [x, y, stacks]]
-        bp_df[stacks] = round(bp_df[stacks]*100)
-
-    all_xs = set(bp_df[x].values)
-    for an, color in color_dict:
-        print(an)
-        if stacks == None:
-            total_bp_df = bp_df[x].value_counts().reset_index().sort_values("count")
-        else:
-            total_bp_df = bp_df.loc[:, [x, stacks]]
-            total_bp_df.columns = [x, "count"]
-
-        xs = set(total_bp_df[x].values)
-        xs_diff = all_xs.difference(xs)
-        if len(xs_diff) !=0:
-            add_df = pd.DataFrame(index = range(len(xs_diff)), data = np.transpose([list(xs_diff), [0]*len(xs_diff)]), columns = [x, "count"]) 
-            total_bp_df = pd.concat([total_bp_df, add_df])
-            total_bp_df["count"] = total_bp_df["count"].astype(int)
-            total_bp_df.sort_values("count")
-
-        if stacks != None:
-            total_bp_df = total_bp_df.groupby("count").sum().reset_index()
-
-        sns.barplot(y = "count", x = x, data = total_bp_df, color = color, order = x_order, orient = "v", errorbar = None)
-
-        bp_df = bp_df.loc[bp_df[y]!=an]
-    plt.show() 
+        table = table.reindex(x_order, fill_value=0)
+
+    if normalize:
+        totals = table.sum(axis=1).to_numpy(dtype=float)
+        totals[totals == 0] = 1
+        table = table.div(totals, axis=0)
+
+    table.index.name = x
+    table.columns.name = y
+    return table
+
+def _color_items(color_dict):
+    '''
+    Internal function returning list of (value, color) from a list of pairs or a dict
+    '''
+    if color_dict is None:
+        raise AssertionError(
+                "color_dict must list the stack values and their colors"
+                )
+    if isinstance(color_dict, dict):
+        return list(color_dict.items())
+    return list(color_dict)
@@ -1,4 +1,9 @@
-import pandas as pd
+import io
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+#Method and source of bootstrap_metrics' resamples, set once per worker process by _init_worker
+_WORKER_STATE=None
 
 def _sens(tp, fn):
     return (tp/(tp+fn))
@@ -9,29 +14,23 @@ def _spec(tn, fp):
 def _acc(tp, tn, total_predictions):
     return ((tp+tn)/total_predictions)
 
-def calculate(
-        results,
-        true_labels,
-        what
-        ):
+_METRICS=['sensitivity', 'specificity', 'accuracy']
 
+def _check_what(what):
     '''
-    results - 1d list-like containing binary predicted results
-    true_labels - 1d list-like containing true labels                
-    what - list-like containing some combination of: 'sensitivity', 'specificity', 'accuracy'
+    Internal function raising AssertionError if what names an unknown metric
     '''
-    labels=pd.DataFrame({"results":results, "true_labels":true_labels})
-    
-    #Match positive and negative patterns
-    tp=((labels==[1,1]).sum(axis=1)==2).sum()
-    
-    fp=((labels==[1,0]).sum(axis=1)==2).sum()
-    
-    fn=((labels==[0,1]).sum(axis=1)==2).sum()
-    
-    tn=((labels==[0,0]).sum(axis=1)==2).sum()
+    if isinstance(what, str) or any(not i in _METRICS for i in what):
+        raise AssertionError(
+                "what must be list-like containing \"sensitivity\", \"accuracy\" and/or \"specificity\""
+                )
 
-    #Calculate multiple metrics
+def _metrics(tn, fp, fn, tp, what, total_predictions):
+    '''
+    Internal function returning list of the metrics in what from confusion counts (numbers or arrays),
+    one per name of what
+    '''
+    _check_what(what)
     metrics=[]
     for i in what:
         if i=='sensitivity':
@@ -39,8 +38,389 @@ def calculate(
         elif i=='specificity':
             metrics.append(_spec(tn, fp))
         elif i=='accuracy':
-            metrics.append(_acc(tp, tn, len(true_labels)))
-        else:
-            print ("Error: what must be list-like containing \"sensitivity\", \"accuracy\" and/or \"specificity\"")
+            metrics.append(_acc(tp, tn, total_predictions))
     return (metrics)
-            
+
+def calculate(
+        results,
+        true_labels,
+        what
+        ):
+
+    '''
+    results - 1d list-like containing binary predicted results
+    true_labels - 1d list-like containing true labels
+    what - list-like containing some combination of: 'sensitivity', 'specificity', 'accuracy'.
+           Other names raise AssertionError
+    '''
+    tn, fp, fn, tp=confusion_counts(results, true_labels)
+
+    #Calculate multiple metrics
+    return (_metrics(tn, fp, fn, tp, what, len(true_labels)))
+
+def confusion_counts(results, true_labels):
+    '''
+    Counts true negatives, false positives, false negatives and true positives with one bincount.
+    Pairs where either value is not 0 or 1 are not counted.
+
+    results - 1d list-like containing binary predicted results, or 2d array of the binary
+              predictions of many models (models by samples)
+    true_labels - 1d list-like containing true labels
+
+    Returns numpy array [tn, fp, fn, tp], or a models by 4 array for 2d results
+    '''
+    results=np.asarray(results)
+    true_labels=np.asarray(true_labels)
+    if results.shape[-1]!=len(true_labels):
+        raise AssertionError(
+                "results and true_labels must have the same number of samples"
+                )
+
+    #Cell of each pair: 2*true label + prediction, in order tn, fp, fn, tp
+    valid=np.isin(results, [0, 1]) & np.isin(true_labels, [0, 1])
+    cells=2*(true_labels==1)+(results==1)
+    if results.ndim==1:
+        return np.bincount(cells[valid], minlength=4)
+
+    models=np.broadcast_to(np.arange(len(results))[:, None], results.shape)
+    return np.bincount((4*models+cells)[valid], minlength=4*len(results)).reshape(len(results), 4)
+
+def threshold_sweep(scores, true_labels, thresholds=None, what=['sensitivity', 'specificity', 'accuracy']):
+    '''
+    Metrics of continuous scores at every threshold, a sample being predicted positive when its
+    score is at least the threshold. Each model's scores are sorted once and the confusion counts
+    at every threshold read from cumulative sums.
+
+    scores - 1d list-like of scores, or 2d array of the scores of many models (models by samples)
+    true_labels - 1d list-like of true labels, 0 or 1
+    thresholds - 1d list-like of thresholds. If None, every distinct score
+    what - list-like containing some combination of: 'sensitivity', 'specificity', 'accuracy'
+
+    Returns Python dict with 'thresholds', 'tn', 'fp', 'fn', 'tp' and the metrics in what as keys,
+    and numpy arrays of one value per threshold (models by thresholds for 2d scores) as values
+    '''
+    _check_what(what)
+    scores=np.asarray(scores, dtype=float)
+    true_labels=np.asarray(true_labels)
+    if not np.isin(true_labels, [0, 1]).all():
+        raise AssertionError(
+                "true_labels must be 0 or 1"
+                )
+    if scores.shape[-1]!=len(true_labels):
+        raise AssertionError(
+                "scores and true_labels must have the same number of samples"
+                )
+
+    one_model=scores.ndim==1
+    scores=np.atleast_2d(scores)
+    n_models, n=scores.shape
+    if thresholds is None:
+        thresholds=np.unique(scores)
+    thresholds=np.asarray(thresholds, dtype=float)
+
+    #Sort each model's scores, with labels carried along, and count positives below each position
+    order=np.argsort(scores, axis=1, kind='stable')
+    sorted_scores=np.take_along_axis(scores, order, axis=1)
+    positives_below=np.zeros((n_models, n+1), dtype=np.int64)
+    np.cumsum(true_labels[order]==1, axis=1, out=positives_below[:, 1:])
+
+    #Samples below each threshold for every model from one searchsorted: scores and thresholds are
+    #replaced by their ranks and offset by model so all rows sort as one array
+    values=np.unique(np.concatenate([sorted_scores.ravel(), thresholds]))
+    offsets=(len(values)*np.arange(n_models))[:, None]
+    keys=(np.searchsorted(values, sorted_scores)+offsets).ravel()
+    queries=np.searchsorted(values, thresholds)[None, :]+offsets
+    below=np.searchsorted(keys, queries, side='left')-n*np.arange(n_models)[:, None]
+
+    positives=int((true_labels==1).sum())
+    fn=np.take_along_axis(positives_below, below, axis=1)
+    tn=below-fn
+    tp=positives-fn
+    fp=n-positives-tn
+
+    swept={'thresholds': thresholds, 'tn': tn, 'fp': fp, 'fn': fn, 'tp': tp}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        swept.update(zip(what, _metrics(tn, fp, fn, tp, what, n)))
+    if one_model:
+        swept.update({i: swept[i][0] for i in swept if i!='thresholds'})
+    return swept
+
+class MetricsAccumulator:
+    '''
+    Running confusion counts of predictions that arrive in chunks (ex. from batch inference in
+    many processes). Accumulators are updated chunk by chunk, merged with merge(), and pickled or
+    written with to_bytes() as a few small arrays. metrics() gives the same values as calculate
+    on the concatenated chunks.
+
+    With score_bins, scores are also counted in a fixed histogram of positives and negatives, so
+    threshold_metrics() gives the same values as threshold_sweep on the concatenated scores with
+    the bin edges as thresholds.
+
+    score_bins - int number of equal bins over score_range, or 1d list-like of increasing bin
+                 edges. None keeps no histogram
+    score_range - tuple of lowest and highest edge when score_bins is an int
+    '''
+
+    def __init__(self, score_bins=None, score_range=(0, 1)):
+        self.counts=np.zeros(4, dtype=np.int64)
+        self.total=0
+        if score_bins is None:
+            self.edges=None
+            self.histogram=None
+        else:
+            if np.ndim(score_bins)==0:
+                self.edges=np.linspace(score_range[0], score_range[1], int(score_bins)+1)
+            else:
+                self.edges=np.asarray(score_bins, dtype=float)
+            if (np.diff(self.edges)<=0).any():
+                raise AssertionError(
+                        "score_bins edges must be increasing"
+                        )
+            #Row 0 negatives, row 1 positives. Column j counts scores in [edges[j-1], edges[j]),
+            #column 0 scores below the first edge and the last column scores from the last edge up
+            self.histogram=np.zeros((2, len(self.edges)+1), dtype=np.int64)
+
+    def update(self, results, true_labels, scores=None):
+        '''
+        Adds a chunk of predictions
+
+        results - 1d list-like containing binary predicted results, or None to only count scores
+        true_labels - 1d list-like containing true labels
+        scores - 1d list-like of continuous scores, required when the accumulator has score_bins
+        '''
+        if results is not None:
+            self.counts+=confusion_counts(results, true_labels)
+            self.total+=len(true_labels)
+
+        if self.histogram is not None:
+            if scores is None:
+                raise AssertionError(
+                        "scores are required when the accumulator has score_bins"
+                        )
+            true_labels=np.asarray(true_labels)
+            if not np.isin(true_labels, [0, 1]).all():
+                raise AssertionError(
+                        "true_labels must be 0 or 1"
+                        )
+            bins=np.searchsorted(self.edges, np.asarray(scores, dtype=float), side='right')
+            self.histogram+=np.bincount(bins+self.histogram.shape[1]*(true_labels==1),
+                                        minlength=self.histogram.size).reshape(self.histogram.shape)
+        return self
+
+    def merge(self, other):
+        '''
+        Adds the counts of another MetricsAccumulator with the same score_bins
+        '''
+        if (self.edges is None)!=(other.edges is None) or (self.edges is not None and
+                                                            not np.array_equal(self.edges, other.edges)):
+            raise AssertionError(
+                    "accumulators must have the same score_bins to be merged"
+                    )
+        self.counts+=other.counts
+        self.total+=other.total
+        if self.histogram is not None:
+            self.histogram+=other.histogram
+        return self
+
+    def metrics(self, what):
+        '''
+        Returns list of metrics of the binary predictions, as calculate
+
+        what - list-like containing some combination of: 'sensitivity', 'specificity', 'accuracy'
+        '''
+        tn, fp, fn, tp=self.counts
+        return (_metrics(tn, fp, fn, tp, what, self.total))
+
+    def threshold_metrics(self, what=['sensitivity', 'specificity', 'accuracy']):
+        '''
+        Returns Python dict of metrics at every bin edge, as threshold_sweep
+        '''
+        _check_what(what)
+        if self.histogram is None:
+            raise AssertionError(
+                    "threshold_metrics needs an accumulator with score_bins"
+                    )
+        #Scores at least edges[j] are those of columns j+1 onwards
+        at_least=np.cumsum(self.histogram[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        negatives, positives=self.histogram.sum(axis=1)
+        fp, tp=at_least
+        tn=negatives-fp
+        fn=positives-tp
+
+        swept={'thresholds': self.edges.copy(), 'tn': tn, 'fp': fp, 'fn': fn, 'tp': tp}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            swept.update(zip(what, _metrics(tn, fp, fn, tp, what, negatives+positives)))
+        return swept
+
+    def to_bytes(self):
+        '''
+        Returns the accumulator serialized as compressed npz bytes
+        '''
+        arrays={'counts': self.counts, 'total': np.int64(self.total)}
+        if self.histogram is not None:
+            arrays.update(edges=self.edges, histogram=self.histogram)
+        buffer=io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''
+        Returns the MetricsAccumulator serialized by to_bytes
+        '''
+        with np.load(io.BytesIO(data)) as arrays:
+            accumulator=cls(arrays['edges'] if 'edges' in arrays else None)
+            accumulator.counts=arrays['counts'].copy()
+            accumulator.total=int(arrays['total'])
+            if 'histogram' in arrays:
+                accumulator.histogram=arrays['histogram'].copy()
+        return accumulator
+
+def bootstrap_metrics(results, true_labels, what, n_resamples=10000, confidence=0.95, method='multinomial',
+                      random_state=0, n_workers=1, return_resamples=False):
+    '''
+    Bootstrap confidence intervals of the metrics of calculate. Every resample's confusion counts
+    are drawn at once and the metrics of all resamples computed in one pass over arrays.
+
+    results - 1d list-like containing binary predicted results
+    true_labels - 1d list-like containing true labels
+    what - list-like containing some combination of: 'sensitivity', 'specificity', 'accuracy'
+    n_resamples - int - number of bootstrap resamples
+    confidence - float - level of the percentile intervals
+    method - "multinomial" draws each resample's counts of the confusion cells from a multinomial
+             over the observed cells, the same distribution as resampling predictions, in time
+             independent of the number of predictions. "index" draws a seeded matrix of resampled
+             prediction indices, in time growing with resamples times predictions
+    random_state - int - seed. Resamples are drawn in fixed batches seeded from it, so results do
+                   not depend on n_workers
+    n_workers - int - number of processes the batches are split across. None uses the number of
+                processors
+    return_resamples - if True also returns the metrics of every resample
+
+    Returns pandas DataFrame with what as index and columns "estimate", "lower" and "upper", and if
+    return_resamples a pandas DataFrame of resamples by metrics
+    '''
+    #Imported here so the counting functions load without pandas
+    import pandas as pd
+
+    _check_what(what)
+    if not method in ['multinomial', 'index']:
+        raise AssertionError(
+                "method must be \"multinomial\" or \"index\""
+                )
+
+    #Cell of each prediction: tn, fp, fn, tp, or 4 where either value is not 0 or 1 (still counted in
+    #the accuracy denominator as by calculate)
+    results=np.asarray(results)
+    true_labels=np.asarray(true_labels)
+    valid=np.isin(results, [0, 1]) & np.isin(true_labels, [0, 1])
+    cells=np.where(valid, 2*(true_labels==1)+(results==1), 4)
+    total=len(cells)
+
+    if method=='multinomial':
+        batch_size=max(1, min(n_resamples, 100000))
+        source=np.bincount(cells, minlength=5)
+    else:
+        batch_size=max(1, min(n_resamples, 2**24//max(1, total)))
+        source=cells
+    sizes=[min(batch_size, n_resamples-start) for start in range(0, n_resamples, batch_size)]
+    seeds=np.random.SeedSequence(random_state).spawn(len(sizes))
+    tasks=list(zip(sizes, seeds))
+
+    if n_workers==1:
+        counts=[_resample_counts(method, source, size, seed) for size, seed in tasks]
+    else:
+        #The source is sent to each worker once, not with every batch
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(method, source)) as e:
+            counts=list(e.map(_worker_resample_counts, tasks))
+    counts=np.concatenate(counts) if counts else np.empty((0, 5), dtype=np.int64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        resampled=pd.DataFrame(dict(zip(what, _metrics(counts[:, 0], counts[:, 1], counts[:, 2], counts[:, 3],
+                                                       what, total))))
+    tn, fp, fn, tp, other=np.bincount(cells, minlength=5)
+    alpha=(1-confidence)/2
+    intervals=pd.DataFrame({
+        'estimate': _metrics(tn, fp, fn, tp, what, total),
+        'lower': resampled.quantile(alpha).to_numpy(),
+        'upper': resampled.quantile(1-alpha).to_numpy()}, index=list(what))
+
+    if return_resamples:
+        return (intervals, resampled)
+    return (intervals)
+
+def permutation_metrics(results, true_labels, what, n_permutations=10000, random_state=0, return_permutations=False):
+    '''
+    Permutation test of the metrics of calculate against predictions unrelated to the true labels.
+    Shuffling the labels against the predictions makes the true positives hypergeometric, so all
+    permutations' confusion counts are drawn at once without shuffling.
+
+    results - 1d list-like containing binary predicted results
+    true_labels - 1d list-like containing true labels
+    what - list-like containing some combination of: 'sensitivity', 'specificity', 'accuracy'
+    n_permutations - int - number of permutations
+    random_state - int - seed
+    return_permutations - if True also returns the metrics of every permutation
+
+    Returns pandas DataFrame with what as index and columns "estimate" and "p_value" (share of
+    permutations at least as high as the estimate, counting the observed data), and if
+    return_permutations a pandas DataFrame of permutations by metrics
+    '''
+    #Imported here so the counting functions load without pandas
+    import pandas as pd
+
+    _check_what(what)
+    tn, fp, fn, tp=confusion_counts(results, true_labels)
+    total=len(true_labels)
+    n=tn+fp+fn+tp
+    predicted=tp+fp
+    positives=tp+fn
+
+    rng=np.random.default_rng(random_state)
+    if n==0:
+        perm_tp=np.zeros(n_permutations, dtype=np.int64)
+    else:
+        perm_tp=rng.hypergeometric(positives, n-positives, predicted, size=n_permutations)
+    perm_fp=predicted-perm_tp
+    perm_fn=positives-perm_tp
+    perm_tn=n-predicted-perm_fn
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        permuted=pd.DataFrame(dict(zip(what, _metrics(perm_tn, perm_fp, perm_fn, perm_tp, what, total))))
+        estimates=np.array(_metrics(tn, fp, fn, tp, what, total), dtype=float)
+    p_values=((permuted.to_numpy()>=estimates-1e-12).sum(axis=0)+1)/(n_permutations+1)
+    tested=pd.DataFrame({'estimate': estimates, 'p_value': p_values}, index=list(what))
+
+    if return_permutations:
+        return (tested, permuted)
+    return (tested)
+
+def _resample_counts(method, source, size, seed):
+    '''
+    Internal function drawing one batch of bootstrap resamples
+
+    method - string - method of bootstrap_metrics
+    source - numpy array of observed cell counts ("multinomial") or cell of each prediction ("index")
+    size - int - number of resamples
+    seed - numpy SeedSequence
+
+    Returns numpy array of resamples by counts of tn, fp, fn, tp and other pairs
+    '''
+    rng=np.random.default_rng(seed)
+    if method=='multinomial':
+        total=source.sum()
+        if total==0:
+            return np.zeros((size, 5), dtype=np.int64)
+        return rng.multinomial(total, source/total, size=size)
+
+    indices=rng.integers(0, len(source), size=(size, len(source)))
+    rows=np.arange(size)[:, None]
+    return np.bincount((5*rows+source[indices]).ravel(), minlength=5*size).reshape(size, 5)
+
+def _init_worker(method, source):
+    global _WORKER_STATE
+    _WORKER_STATE=(method, source)
+
+def _worker_resample_counts(task):
+    size, seed=task
+    return _resample_counts(*_WORKER_STATE, size, seed)